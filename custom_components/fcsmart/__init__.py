@@ -6,7 +6,9 @@ from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
 
 from . import hub
-from .const import DOMAIN
+from .const import DOMAIN, CONF_COMMAND_TTL, CONF_LOCAL_CONTROL
+from .push import async_setup_push, async_unload_push
+from .services import async_setup_services, async_unload_services
 from .core.fingercrystal_cloud import (
     FiotCloud,
     FcCloudException,
@@ -23,25 +25,54 @@ PLATFORMS: list[str] = ["lock", "sensor"]
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Hello World from a config entry."""
 
-    fcc = await FiotCloud.from_token(hass, entry.data, login=False)
+    config = hub.entry_config(entry)
+    fcc = None
     dvs = []
+    cursors = {}
     try:
-        await fcc.async_login()
-        await fcc.async_stored_auth(fcc.user_id, save=True)
-        dvs = await fcc.async_get_devices(renew=True) or []
+        fcc = await FiotCloud.async_get_session(hass, config)
+        # Entities of known devices come up at once, the list is renewed below.
+        dvs = await fcc.async_cached_devices()
+        cursors = await fcc.async_event_cursors()
     except (FcCloudException, FcCloudAccessDenied) as exc:
-        _LOGGER.error('Setup fingercrystal cloud for user: %s failed: %s', fcc.username, exc)
+        FiotCloud.drop_session(hass, config)
+        _LOGGER.error('Setup fingercrystal cloud for user: %s failed: %s', entry.data.get('username'), exc)
+    except OSError as exc:  # requests.ConnectionError and CircuitOpenError are OSErrors
+        _LOGGER.warning('Fingercrystal cloud unreachable for user: %s, using cached data: %s',
+                        entry.data.get('username'), exc)
+    if fcc is None:
+        fcc = await FiotCloud.from_token(hass, config, login=False)
+    if not dvs and fcc.user_id:
+        dvs = await fcc.async_cached_devices()
 
     # Store an instance of the "connecting" class that does the work of speaking
     # with your actual devices.
-    hass.data.setdefault(DOMAIN, {})[entry.entry_id] = hub.Hub(hass, entry.data, fcc, dvs)
+    hub_ = hub.Hub(hass, config, fcc, dvs, cursors)
+    hub_.options = dict(entry.options)
+    if fcc.user_id:
+        await hub_.async_load_telemetry()
+    await hub_.async_load_commands()
+    hass.data.setdefault(DOMAIN, {})[entry.entry_id] = hub_
 
     # This creates each HA object for each platform your device requires.
     # It's done by calling the `async_setup_entry` function in each platform module.
     hass.config_entries.async_setup_platforms(entry, PLATFORMS)
+    async_setup_services(hass)
+    await async_setup_push(hass, entry)
+    if fcc.user_id:
+        hass.async_create_task(hub_.async_refresh_devices())
+    entry.async_on_unload(entry.add_update_listener(async_update_options))
     return True
 
 
+async def async_update_options(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload an entry whose options changed, the settings are read on setup."""
+    hub_ = hass.data.get(DOMAIN, {}).get(entry.entry_id)
+    # Also called when the data changes, e.g. the webhook id is stored.
+    if hub_ is not None and hub_.options != dict(entry.options):
+        await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     # This is called when an entry/configured device is to be removed. The class
@@ -49,6 +80,32 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # details
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        async_unload_push(hass, entry)
+        hub_ = hass.data[DOMAIN].pop(entry.entry_id)
+        await hub_.async_shutdown()
+        if hub_.fc_cloud.user_id:
+            await hub_.fc_cloud.async_event_cursors(hub_.event_cursors())
+            await hub_.async_save_telemetry()
+        async_unload_services(hass)
 
     return unload_ok
+
+
+async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Migrate an entry created with older defaults."""
+    if entry.version == 1:
+        # Version 1 entries stored local_control on by default, it is experimental.
+        entry.version = 2
+        hass.config_entries.async_update_entry(entry, data={**entry.data, CONF_LOCAL_CONTROL: False})
+        _LOGGER.info('Migrated fingercrystal entry of %s to version 2', entry.data.get('username'))
+    if entry.version == 2:
+        # Version 2 entries stored a command queue by default, a late unlock is opt in.
+        entry.version = 3
+        hass.config_entries.async_update_entry(entry, data={**entry.data, CONF_COMMAND_TTL: 0})
+        _LOGGER.info('Migrated fingercrystal entry of %s to version 3', entry.data.get('username'))
+    return True
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Forget the cached login of a removed entry."""
+    FiotCloud.drop_session(hass, hub.entry_config(entry))
@@ -2,12 +2,13 @@
 from __future__ import annotations
 
 import logging
+from functools import partial
 from typing import Any
 
 import voluptuous as vol
 
 from homeassistant import config_entries, exceptions
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 
 from .const import *  # pylint:disable=unused-import
 
@@ -20,6 +21,8 @@ from .core.fingercrystal_cloud import (
     FcCloudException,
     FcCloudAccessDenied,
 )
+from .core import health, workers
+from .hub import mqtt_port_for
 
 
 async def validate_input(hass: HomeAssistant, data: dict) -> dict[str, Any]:
@@ -35,27 +38,67 @@ async def validate_input(hass: HomeAssistant, data: dict) -> dict[str, Any]:
     errors = {}
     if len(data["username"]) < 3:
         raise InvalidHost
+    names = workers.parse(data.get(CONF_WORKERS))
+    if names and data.get(CONF_WORKER_ID) not in names:
+        raise InvalidWorker
+
+    # Probe before logging in, so an unreachable host fails fast with a precise error.
+    eps = FiotCloud.resolve_endpoints(data)
+    report = await hass.async_add_executor_job(partial(
+        health.run, eps.api, eps.mqtt_host, mqtt_port_for(data, eps), bool(data.get(CONF_MQTT_TLS)),
+    ))
+    _LOGGER.debug('Fingercrystal health report: %s', report)
+    if not report['checks']['api']['ok']:
+        raise CannotConnect(report['checks']['api']['error'])
+    if not report['checks']['mqtt']['ok']:
+        raise CannotConnectMqtt(report['checks']['mqtt']['error'])
 
-    fcc = await FiotCloud.from_token(hass, data, login=False)
     try:
-        await fcc.async_login()
-        await fcc.async_stored_auth(fcc.user_id, save=True)
+        # The logged in client is cached, entry setup picks it up.
+        await FiotCloud.async_get_session(hass, data)
     except (FcCloudException, FcCloudAccessDenied) as exc:
         errors['base'] = 'cannot_login'
-        _LOGGER.error('Setup fingercrystal cloud for user: %s failed: %s', fcc.username, exc)
+        _LOGGER.error('Setup fingercrystal cloud for user: %s failed: %s', data['username'], exc)
+    except OSError as exc:  # requests.ConnectionError and CircuitOpenError are OSErrors
+        raise CannotConnect from exc
     return data
 
 
+def tunables_schema(defaults: dict) -> dict:
+    """Return the schema of the settings that may change after setup, with `defaults`."""
+    return {
+        vol.Optional(CONF_API_HOST, default=defaults.get(CONF_API_HOST, '')): str,
+        vol.Optional(CONF_MQTT_HOST, default=defaults.get(CONF_MQTT_HOST, '')): str,
+        vol.Optional(CONF_MQTT_PORT, default=defaults.get(CONF_MQTT_PORT, 0)): vol.Coerce(int),
+        vol.Optional(CONF_MQTT_TLS, default=defaults.get(CONF_MQTT_TLS, False)): bool,
+        vol.Optional(CONF_MQTT_KEEPALIVE, default=defaults.get(CONF_MQTT_KEEPALIVE, 60)):
+            vol.All(vol.Coerce(int), vol.Range(min=10, max=3600)),
+        vol.Optional(CONF_MQTT_RECORD, default=defaults.get(CONF_MQTT_RECORD, False)): bool,
+        vol.Optional(CONF_LOCAL_CONTROL, default=defaults.get(CONF_LOCAL_CONTROL, False)): bool,
+        vol.Optional(CONF_BATTERY_DEADBAND, default=defaults.get(CONF_BATTERY_DEADBAND, 2)):
+            vol.All(vol.Coerce(int), vol.Range(min=0, max=20)),
+        vol.Optional(CONF_COMMAND_TTL, default=defaults.get(CONF_COMMAND_TTL, 0)):
+            vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+        vol.Optional(CONF_WORKER_ID, default=defaults.get(CONF_WORKER_ID, '')): str,
+        vol.Optional(CONF_WORKERS, default=defaults.get(CONF_WORKERS, '')): str,
+    }
+
+
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for Hello World."""
 
-    VERSION = 1
+    VERSION = 3
     # Pick one of the available connection classes in homeassistant/config_entries.py
     # This tells HA if it should be asking for updates, or it'll be notified of updates
     # automatically. This example uses PUSH, as the dummy hub will notify HA of
     # changes.
     CONNECTION_CLASS = config_entries.CONN_CLASS_LOCAL_PUSH
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return OptionsFlowHandler(config_entry)
+
     async def async_step_user(self, user_input=None):
         """Handle the initial step."""
         # This goes through the steps to take the user through the setup process.
@@ -74,6 +117,10 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 return self.async_create_entry(title=f"FcSmart: {user_input['username']}", data=user_input)
             except CannotConnect:
                 errors["base"] = "cannot_connect"
+            except CannotConnectMqtt:
+                errors["base"] = "cannot_connect_mqtt"
+            except InvalidWorker:
+                errors["base"] = "invalid_worker"
             except InvalidHost:
                 # The error string is set here, and should be translated.
                 # This example does not currently cover translations, see the
@@ -92,14 +139,54 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 vol.Required(CONF_PASSWORD, default=user_input.get(CONF_PASSWORD, vol.UNDEFINED)): str,
                 vol.Required(CONF_SERVER_COUNTRY, default=user_input.get(CONF_SERVER_COUNTRY, 'cn')):
                     vol.In(CLOUD_SERVERS),
+                **tunables_schema(user_input),
             }),
             errors=errors,
         )
 
 
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Change the settings of an entry, it is reloaded with them."""
+
+    def __init__(self, config_entry):
+        self.config_entry = config_entry
+
+    async def async_step_init(self, user_input=None):
+        errors = {}
+        current = {**self.config_entry.data, **self.config_entry.options}
+        if user_input is not None:
+            try:
+                # Probed and logged in as on setup, the hosts may have changed.
+                await validate_input(self.hass, {**current, **user_input})
+                return self.async_create_entry(title='', data=user_input)
+            except CannotConnect:
+                errors["base"] = "cannot_connect"
+            except CannotConnectMqtt:
+                errors["base"] = "cannot_connect_mqtt"
+            except InvalidWorker:
+                errors["base"] = "invalid_worker"
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Unexpected exception")
+                errors["base"] = "unknown"
+            current.update(user_input)
+        return self.async_show_form(
+            step_id='init',
+            data_schema=vol.Schema(tunables_schema(current)),
+            errors=errors,
+        )
+
+
 class CannotConnect(exceptions.HomeAssistantError):
     """Error to indicate we cannot connect."""
 
 
+class CannotConnectMqtt(exceptions.HomeAssistantError):
+    """Error to indicate the MQTT broker cannot be reached."""
+
+
 class InvalidHost(exceptions.HomeAssistantError):
     """Error to indicate there is an invalid hostname."""
+
+
+class InvalidWorker(exceptions.HomeAssistantError):
+    """Error to indicate the worker id is not one of the workers."""
@@ -7,6 +7,23 @@ DOMAIN = "fcsmart"
 CONF_USERNAME = 'username'
 CONF_PASSWORD = 'password'
 CONF_SERVER_COUNTRY = 'server_country'
+CONF_API_HOST = 'api_host'
+CONF_MQTT_HOST = 'mqtt_host'
+CONF_MQTT_PORT = 'mqtt_port'
+CONF_MQTT_TLS = 'mqtt_tls'
+CONF_MQTT_KEEPALIVE = 'mqtt_keepalive'
+CONF_MQTT_RECORD = 'mqtt_record'
+CONF_LOCAL_CONTROL = 'local_control'
+CONF_BATTERY_DEADBAND = 'battery_deadband'
+CONF_WEBHOOK_ID = 'webhook_id'
+CONF_WEBHOOK_SECRET = 'webhook_secret'
+CONF_MQTT_SHARE_GROUP = 'mqtt_share_group'
+CONF_WORKER_ID = 'worker_id'
+CONF_WORKERS = 'workers'
+CONF_COMMAND_TTL = 'command_ttl'
+
+ATTR_DRAIN_PER_DAY = 'drain_per_day'
+ATTR_REPLACE_LEVEL = 'replace_level'
 
 CLOUD_SERVERS = {
     'cn': 'China',
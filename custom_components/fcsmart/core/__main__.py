@@ -0,0 +1,148 @@
+"""Headless client of the fingercrystal cloud and MQTT broker, for audits without Home Assistant.
+
+Run from the integration directory:
+
+    python -m core devices
+    python -m core tail [--count N] [--seconds S] [did ...]
+    python -m core export [--events] [--since MS]
+
+Records are written as NDJSON, one per line as they arrive: the device
+list and event history are parsed page by page, so memory stays flat
+however large the account. It only reads: no lock command is known, see
+`core.transport`.
+Credentials come from --username/--password or the FCSMART_USERNAME and
+FCSMART_PASSWORD environment variables.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import uuid
+
+from . import endpoints
+from .fccloud import DEVICE_PAGE_SIZE, FcCloud
+from .fccloudexception import FcCloudAccessDenied, FcCloudException
+from .fcmq import FcOpenMQ
+from .pool import CLIENT_ID_PREFIX, get_pool
+
+_out_lock = threading.Lock()
+
+
+def emit(record):
+    """Write one NDJSON record to stdout."""
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _out_lock:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+
+def connect(args) -> FcCloud:
+    """Resolve the endpoints and log in, return the client."""
+    host, _, port = (args.mqtt or '').partition(':')
+    args.eps = endpoints.resolve({
+        'api_host': args.api, 'mqtt_host': host, 'mqtt_port': int(port) if port else None,
+    })
+    if args.rate:
+        # Created before the client, which then picks it up from the pool.
+        get_pool().limiter(f'{args.eps.api}/{args.username}', rate=args.rate, burst=max(1, int(args.rate * 2)))
+    fcc = FcCloud(args.username, args.password, api_host=args.eps.api)
+    fcc._init_session()
+    try:
+        response = fcc._login()
+    except (KeyError, TypeError, ValueError) as exc:
+        raise FcCloudAccessDenied(f'login of {args.username} failed: {exc}') from exc
+    if response.status_code != 200 or not fcc.service_token:
+        raise FcCloudAccessDenied(f'login of {args.username} failed: {response.status_code}')
+    return fcc
+
+
+def cmd_devices(args, fcc):
+    for dev in fcc.iter_devices(args.page_size):
+        emit(dev)
+
+
+def cmd_export(args, fcc):
+    for dev in fcc.iter_devices(args.page_size):
+        emit({'type': 'device', **dev})
+        if not args.events:
+            continue
+        try:
+            for evt in fcc.iter_device_events(dev['id'], args.since, args.batch):
+                emit({'type': 'event', 'device': dev['id'], **evt})
+        except (FcCloudException, OSError) as exc:
+            emit({'type': 'error', 'device': dev['id'], 'error': str(exc)})
+
+
+def cmd_tail(args, fcc):
+    done = threading.Event()
+    seen = [0]
+    fc_mq = FcOpenMQ(
+        f'{CLIENT_ID_PREFIX}-cli-{uuid.uuid4().hex[:6]}', None,
+        host=args.eps.mqtt_host, port=args.eps.mqtt_port, tls=args.tls, devices=[], clean_session=True,
+    )
+
+    def printer(did):
+        def on_message(msg_dict):
+            emit({'device': did, **msg_dict})
+            with _out_lock:
+                seen[0] += 1
+                if args.count and seen[0] >= args.count:
+                    done.set()
+        return on_message
+
+    signal.signal(signal.SIGTERM, lambda *_: done.set())
+    fc_mq.start()
+    try:
+        dids = args.devices or (dev['id'] for dev in fcc.iter_devices(args.page_size))
+        for did in dids:
+            fc_mq.add_device(did, printer(str(did)))
+        done.wait(args.seconds)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fc_mq.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--username', default=os.environ.get('FCSMART_USERNAME'))
+    parser.add_argument('--password', default=os.environ.get('FCSMART_PASSWORD'))
+    parser.add_argument('--api', help='API server, e.g. http://host:port')
+    parser.add_argument('--mqtt', help='MQTT broker host[:port]')
+    parser.add_argument('--tls', action='store_true', help='use TLS for MQTT')
+    parser.add_argument('--rate', type=float, help='cloud requests per second, the account budget by default')
+    parser.add_argument('--page-size', type=int, default=DEVICE_PAGE_SIZE)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('devices', help='list the devices')
+
+    tail = sub.add_parser('tail', help='stream lock messages')
+    tail.add_argument('--count', type=int, help='stop after this many messages')
+    tail.add_argument('--seconds', type=float, help='stop after this long')
+    tail.add_argument('devices', nargs='*', help='device ids, all devices by default')
+
+    export = sub.add_parser('export', help='export the devices, and their event history')
+    export.add_argument('--events', action='store_true')
+    export.add_argument('--since', type=int, default=0, help='events after this time, in ms')
+    export.add_argument('--batch', type=int, default=50, help='events per request')
+
+    args = parser.parse_args(argv)
+    if not args.username or not args.password:
+        parser.error('--username and --password, or FCSMART_USERNAME and FCSMART_PASSWORD, are required')
+    commands = {'devices': cmd_devices, 'tail': cmd_tail, 'export': cmd_export}
+    try:
+        fcc = connect(args)
+        return commands[args.command](args, fcc) or 0
+    except BrokenPipeError:
+        # The reader, e.g. head, is gone.
+        sys.stderr.close()
+        return 0
+    except (FcCloudException, FcCloudAccessDenied, OSError) as exc:
+        print(f'{type(exc).__name__}: {exc}', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
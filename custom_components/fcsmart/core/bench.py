@@ -0,0 +1,210 @@
+"""Load and regression benchmark against local broker and cloud stand-ins.
+
+Run from the repository root, with Home Assistant installed for `hub.Roller`:
+
+    python -m custom_components.fcsmart.core.bench --locks 200 --rate 500 --duration 30
+
+It logs in and fetches the device list from a `FakeCloudServer`, takes the
+pooled `FcOpenMQ` of a `LocalBroker` and adds a `hub.Roller` per simulated
+lock to it, as `hub.Hub` does, then publishes lock messages at the
+requested rate and measures how long each takes to be applied to its
+roller.
+
+With --imports it instead measures, in fresh interpreters, the import time
+of the core modules and the cost of building a `FcCloud`, also from the
+integration directory:
+
+    python -m core.bench --imports --max-import-ms 100
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from .fccloud import FcCloud
+from .metrics import percentile
+from .pool import get_pool
+from .standin import FakeCloudServer, LocalBroker, make_devices
+
+_LOGGER = logging.getLogger(__name__)
+
+CORE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_MODULES = ('core.fccloud', 'core.fcmq', 'core.fcutils')
+IMPORT_BUDGET_MS = 100
+
+_IMPORT_PROBE = """
+import time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+from core.fccloud import FcCloud
+FcCloud('bench', 'bench')
+t2 = time.perf_counter()
+for _ in range(100):
+    FcCloud('bench', 'bench')
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, (t3 - t2) / 100)
+"""
+
+
+def measure_imports(modules=IMPORT_MODULES, runs=3):
+    """Return the best of `runs` cold import times and FcCloud construction costs."""
+    report = {}
+    for module in modules:
+        best = None
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, '-c', _IMPORT_PROBE.format(module=module)],
+                cwd=CORE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.split()
+            vals = [float(v) for v in out]
+            best = vals if best is None else [min(a, b) for a, b in zip(best, vals)]
+        report[module] = {
+            'import_ms': round(best[0] * 1000, 2),
+            'first_client_ms': round(best[1] * 1000, 2),
+            'client_us': round(best[2] * 1e6, 2),
+        }
+    return report
+
+
+def rss_bytes():
+    """Return the current resident set size of this process."""
+    try:
+        with open('/proc/self/statm') as fil:
+            return int(fil.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StateSink:
+    """Feeds messages to `Roller`s, records message to state latency."""
+
+    def __init__(self, metrics):
+        # The rollers count duplicates and stale updates into the hub's metrics.
+        self.metrics = metrics
+        self.latencies = []
+        self._lock = threading.Lock()
+        self.received = threading.Semaphore(0)
+
+    def listener(self, roller):
+        def on_message(msg_dict):
+            roller.on_message(msg_dict)
+            now = time.perf_counter()
+            with self._lock:
+                self.latencies.append(now - msg_dict['bench_ts'])
+            self.received.release()
+        return on_message
+
+
+def run(locks=10, rate=100, duration=10, qos=0):
+    """Run one benchmark and return its report."""
+    try:
+        from ..hub import Roller  # pylint: disable=import-outside-toplevel
+    except ImportError as exc:
+        raise RuntimeError(
+            'the message benchmark needs Home Assistant, run it as custom_components.fcsmart.core.bench'
+        ) from exc
+    broker = LocalBroker().start()
+    cloud = FakeCloudServer(make_devices(locks)).start()
+    fc_mq = None
+    cpu0 = time.process_time()
+    try:
+        started = time.perf_counter()
+        fcc = FcCloud('bench', 'bench', api_host=cloud.url)
+        fcc._init_session()
+        fcc._login()
+        dvs = list(fcc.iter_devices())
+        fcc.request_miot_api('miotspec/prop/get', {'params': [{'did': d['id'], 'siid': 2, 'piid': 1} for d in dvs]})
+        sink = StateSink(fcc.metrics)
+        fc_mq = get_pool().acquire_mq(broker.host, broker.port)
+        for dev in dvs:
+            fc_mq.add_device(dev['id'], sink.listener(Roller(dev['id'], dev['name'], sink)))
+        if not broker.wait_subscriptions(len(dvs), timeout=max(10, locks / 10)):
+            raise RuntimeError(f'only {broker.subscription_count()} of {len(dvs)} locks subscribed')
+        setup_time = time.perf_counter() - started
+
+        total = int(rate * duration)
+        interval = 1 / rate if rate else 0
+        began = time.perf_counter()
+        for seq, dev in zip(range(total), itertools.cycle(dvs)):
+            due = began + seq * interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            broker.publish(f"smartLock/homeassistant/{dev['id']}", json.dumps({
+                'id': seq,
+                't': int(time.time() * 1000),
+                'data': {'battery': 100 - seq % 100, 'unlocking': bool(seq % 2)},
+                'bench_ts': time.perf_counter(),
+            }), qos)
+        deadline = time.monotonic() + 10
+        lost = 0
+        for _ in range(total):
+            if not sink.received.acquire(timeout=max(0, deadline - time.monotonic())):
+                lost += 1
+        elapsed = time.perf_counter() - began
+        threads = threading.active_count()
+        rss = rss_bytes()
+    finally:
+        if fc_mq is not None:
+            get_pool().release_mq(fc_mq)
+        cloud.stop()
+        broker.stop()
+
+    lats = sorted(sink.latencies)
+    return {
+        'locks': locks,
+        'rate': rate,
+        'messages': total,
+        'lost': lost,
+        'setup_s': round(setup_time, 3),
+        'throughput': round(len(lats) / elapsed, 1) if elapsed else 0,
+        'latency_ms': {
+            f'p{p}': round(percentile(lats, p) * 1000, 3)
+            for p in (50, 90, 99)
+        } | {'max': round(lats[-1] * 1000, 3) if lats else 0},
+        'cpu_s': round(time.process_time() - cpu0, 3),
+        'threads': threads,
+        'rss_mb': round(rss / 1048576, 1),
+        'counters': fcc.metrics.as_dict()['counters'],
+        'mqtt': fc_mq.metrics.as_dict()['counters'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--locks', type=int, default=10, help='simulated locks (N)')
+    parser.add_argument('--rate', type=float, default=100, help='messages per second (M)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load')
+    parser.add_argument('--qos', type=int, default=0, choices=(0, 1))
+    parser.add_argument('--max-p99-ms', type=float, help='fail if p99 latency exceeds this')
+    parser.add_argument('--max-setup-s', type=float, help='fail if setup exceeds this')
+    parser.add_argument('--imports', action='store_true', help='measure import and construction time only')
+    parser.add_argument('--max-import-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help='with --imports, fail if a module import exceeds this')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    if args.imports:
+        report = measure_imports()
+        print(json.dumps(report, indent=2))
+        return 1 if any(r['import_ms'] > args.max_import_ms for r in report.values()) else 0
+    report = run(args.locks, args.rate, args.duration, args.qos)
+    print(json.dumps(report, indent=2))
+
+    failed = report['lost'] > 0
+    if args.max_p99_ms is not None and report['latency_ms']['p99'] > args.max_p99_ms:
+        failed = True
+    if args.max_setup_s is not None and report['setup_s'] > args.max_setup_s:
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
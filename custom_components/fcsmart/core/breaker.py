@@ -0,0 +1,105 @@
+"""Circuit breaker for the cloud endpoints.
+
+Closed, calls go through. After `failures` consecutive failures or slow
+calls the breaker opens and calls fail at once with CircuitOpenError, an
+OSError like the connection errors callers already handle by serving
+cached data. After `reset_timeout` seconds a single call is let through
+half-open: success closes the breaker, failure opens it again.
+"""
+import threading
+import time
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURES = 5
+SLOW_CALL = 10.0
+RESET_TIMEOUT = 30.0
+
+
+class CircuitOpenError(ConnectionError):
+    """The endpoint is failing, the call was not made."""
+
+
+class CircuitBreaker:
+    """Thread safe breaker of one endpoint."""
+
+    def __init__(self, name, failures=FAILURES, slow_call=SLOW_CALL, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failures = failures
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened_at = None
+        self.opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Reserve a call, raise CircuitOpenError when it must not be made."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f'{self.name} is unavailable, retry in {self.retry_in():.0f}s')
+
+    def record(self, ok, elapsed=0.0):
+        """Record the outcome of a call reserved by before_call."""
+        if ok and elapsed > self.slow_call:
+            ok = False
+        with self._lock:
+            probe = self._probing
+            self._probing = False
+            if ok:
+                if self.state != CLOSED:
+                    _LOGGER.info('%s recovered, closing circuit', self.name)
+                self.state = CLOSED
+                self.consecutive = 0
+                return
+            self.consecutive += 1
+            if probe or self.consecutive >= self.failures:
+                if self.state == CLOSED:
+                    _LOGGER.warning('%s failed %s times, opening circuit', self.name, self.consecutive)
+                    self.opened += 1
+                elif probe:
+                    _LOGGER.debug('%s probe failed, circuit stays open', self.name)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_in(self):
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def call(self, func, *args, **kwargs):
+        """Call `func` through the breaker, any exception counting as a failure."""
+        self.before_call()
+        started = time.monotonic()
+        try:
+            rdt = func(*args, **kwargs)
+        except Exception:
+            self.record(False)
+            raise
+        self.record(True, time.monotonic() - started)
+        return rdt
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'state': self.state,
+            'consecutive_failures': self.consecutive,
+            'opened': self.opened,
+            'rejected': self.rejected,
+            'retry_in': round(self.retry_in(), 1),
+        }
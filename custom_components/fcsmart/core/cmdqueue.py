@@ -0,0 +1,201 @@
+"""Durable queue of lock commands that could not be sent, replayed when the lock is reachable again.
+
+The queue is an append-only file of JSON lines, one per change:
+
+    {"op": "put", "key": "...", "did": "...", "action": "unlock", "t": 1700000000.0, "expires": 1700000300.0}
+    {"op": "done", "key": "...", "status": "sent"}
+
+A change is one small buffered write, and the file is rewritten with just
+the live commands once it has grown to several times their number. A lock
+has at most one queued command, a newer one supersedes it, and commands
+are dropped when they expire: a late unlock is worse than none. Keys of
+finished commands are remembered for a while with their status, so a
+retried `put` with the same key is not queued twice, and the retry can
+tell what became of the first.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+MAX_COMMANDS = 256
+RECENT_KEYS = 1024
+# The file is compacted when it has this many lines per live record, plus slack.
+COMPACT_FACTOR = 4
+COMPACT_SLACK = 64
+
+STATUS_QUEUED = 'queued'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_EXPIRED = 'expired'
+STATUS_SUPERSEDED = 'superseded'
+STATUS_DROPPED = 'dropped'
+
+
+class CommandQueue:
+    """Thread safe, file backed queue of commands, at most one per device."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_size=MAX_COMMANDS):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._commands = OrderedDict()
+        self._by_device = {}
+        self._recent = OrderedDict()
+        self._lines = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as fil:
+                for line in fil:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # The torn last line of a crash.
+                        continue
+                    if rec.get('op') == 'put':
+                        self._add(rec)
+                    elif rec.get('op') == 'done':
+                        self._finish(rec.get('key'), rec.get('status'))
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._compact()
+
+    def _add(self, cmd):
+        old = self._by_device.get(cmd['did'])
+        if old is not None:
+            self._finish(old, STATUS_SUPERSEDED)
+        self._commands[cmd['key']] = cmd
+        self._by_device[cmd['did']] = cmd['key']
+
+    def _finish(self, key, status=None):
+        cmd = self._commands.pop(key, None)
+        if cmd is not None and self._by_device.get(cmd['did']) == key:
+            del self._by_device[cmd['did']]
+        self._recent[key] = status
+        while len(self._recent) > RECENT_KEYS:
+            self._recent.popitem(last=False)
+        return cmd
+
+    def _write(self, rec):
+        self._file.write(json.dumps(rec, separators=(',', ':')) + '\n')
+        self._file.flush()
+        self._lines += 1
+        if self._lines > COMPACT_FACTOR * (len(self._commands) + len(self._recent)) + COMPACT_SLACK:
+            self._compact()
+
+    def _compact(self):
+        if self._file is not None:
+            self._file.close()
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fil:
+            for key, status in self._recent.items():
+                fil.write(json.dumps({'op': 'done', 'key': key, 'status': status}, separators=(',', ':')) + '\n')
+            for cmd in self._commands.values():
+                fil.write(json.dumps(cmd, separators=(',', ':')) + '\n')
+            fil.flush()
+            os.fsync(fil.fileno())
+        os.replace(tmp, self.path)
+        self._lines = len(self._recent) + len(self._commands)
+        self._file = open(self.path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+
+    def _done(self, key, status):
+        cmd = self._finish(key, status)
+        if cmd is not None:
+            self._write({'op': 'done', 'key': key, 'status': status})
+        return cmd
+
+    def record(self, key, status=STATUS_SENT):
+        """Remember the `status` of a command with `key` handled without being queued."""
+        with self._lock:
+            if key not in self._commands:
+                self._finish(key, status)
+                self._write({'op': 'done', 'key': key, 'status': status})
+
+    def put(self, did, action, key=None, ttl=None, now=None):
+        """Queue a command, superseding the one queued for the device.
+
+        Returns the command, or None when a command with `key` was queued
+        or finished before.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if key is not None and self.seen(key):
+                return None
+            cmd = {
+                'op': 'put',
+                'key': key or uuid.uuid4().hex,
+                'did': str(did),
+                'action': action,
+                't': now,
+                'expires': now + (self.ttl if ttl is None else ttl),
+            }
+            old = self._by_device.get(cmd['did'])
+            if old is not None:
+                self._done(old, STATUS_SUPERSEDED)
+            while len(self._commands) >= self.max_size:
+                oldest = next(iter(self._commands.values()))
+                _LOGGER.warning('Command queue full, dropping %s of %s', oldest['action'], oldest['did'])
+                self._done(oldest['key'], STATUS_DROPPED)
+            self._add(cmd)
+            self._write(cmd)
+            return cmd
+
+    def supersede(self, did):
+        """Cancel the command queued for a device, return it if there was one."""
+        with self._lock:
+            key = self._by_device.get(str(did))
+            return None if key is None else self._done(key, STATUS_SUPERSEDED)
+
+    def done(self, key, status=STATUS_SENT):
+        """Remove a command, return it unless it was already gone, e.g. superseded."""
+        with self._lock:
+            return self._done(key, status)
+
+    def expire(self, now=None):
+        """Remove and return the expired commands."""
+        now = time.time() if now is None else now
+        with self._lock:
+            keys = [key for key, cmd in self._commands.items() if cmd['expires'] <= now]
+            return [self._done(key, STATUS_EXPIRED) for key in keys]
+
+    def pending(self):
+        """Return the queued commands, oldest first."""
+        with self._lock:
+            return list(self._commands.values())
+
+    def has(self, did) -> bool:
+        return str(did) in self._by_device
+
+    def is_queued(self, key) -> bool:
+        return key in self._commands
+
+    def seen(self, key) -> bool:
+        """Return True if a command with `key` is queued or was finished lately."""
+        return key in self._commands or key in self._recent
+
+    def status(self, key):
+        """Return the status of a command with `key`, None if not seen or not known."""
+        with self._lock:
+            if key in self._commands:
+                return STATUS_QUEUED
+            return self._recent.get(key)
+
+    def __len__(self):
+        return len(self._commands)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
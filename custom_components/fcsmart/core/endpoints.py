@@ -0,0 +1,47 @@
+"""The cloud API and MQTT endpoints, the fixed hosts unless overridden."""
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# The cloud serves every server_country from these hosts, no regional ones
+# are known. The api_host, mqtt_host and mqtt_port options point elsewhere.
+DEFAULT_API = 'http://10.0.0.176:2018'
+DEFAULT_MQTT_HOST = '106.55.145.207'
+DEFAULT_MQTT_PORT = 1883
+OVERRIDE_KEYS = ('api_host', 'mqtt_host', 'mqtt_port')
+
+
+class Endpoints:
+    """API and MQTT endpoints."""
+
+    def __init__(self, api, mqtt_host, mqtt_port):
+        self.api = api
+        self.mqtt_host = mqtt_host
+        self.mqtt_port = int(mqtt_port)
+        self.overridden = False
+
+    def to_dict(self):
+        return {
+            'api': self.api,
+            'mqtt_host': self.mqtt_host,
+            'mqtt_port': self.mqtt_port,
+            'overridden': self.overridden,
+        }
+
+
+def resolve(overrides=None):
+    """Return the Endpoints to use.
+
+    `overrides` may contain api_host, mqtt_host and mqtt_port, which replace
+    the default hosts, other keys and empty values are ignored.
+    """
+    overrides = {k: v for k, v in (overrides or {}).items() if k in OVERRIDE_KEYS and v}
+    eps = Endpoints(
+        overrides.get('api_host') or DEFAULT_API,
+        overrides.get('mqtt_host') or DEFAULT_MQTT_HOST,
+        overrides.get('mqtt_port') or DEFAULT_MQTT_PORT,
+    )
+    eps.overridden = bool(overrides)
+    if overrides:
+        _LOGGER.debug('Using fingercrystal endpoints %s', eps.to_dict())
+    return eps
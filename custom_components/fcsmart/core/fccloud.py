@@ -1,20 +1,28 @@
 
-import http.client, http.cookies
 import json
 import hashlib
 import logging
-import time, locale, datetime
-import tzlocal
-import requests
+import time
 
 from . import fcutils
 from .fccloudexception import FcCloudAccessDenied, FcCloudException
+from .jsonstream import iter_items
+from .metrics import Metrics
+from .pool import get_pool
+from .ratelimit import INTERACTIVE, STATE, DEVICES, BACKGROUND, LANE_NAMES
+
+API_HOST = "http://10.0.0.176:2018"
+REQUEST_TIMEOUT = 15
+DEVICE_PAGE_SIZE = 200
 
 
 class FcCloud():
 
-    def __init__(self, username, password):
+    def __init__(self, username, password, api_host=None):
         super().__init__()
+        self.api_host =      api_host or API_HOST
+        self.metrics =       Metrics()
+        self.breaker =       get_pool().breaker(self.api_host)
         self.user_id =       None
         self.service_token = None
         self.session =       None
@@ -24,19 +32,17 @@ class FcCloud():
 
         self.failed_logins = 0 
 
-        self.agent_id = fcutils.get_random_agent_id()
-        self.useragent = "Android-7.1.1-1.0.0-ONEPLUS A3010-136-" + self.agent_id + " APP/xiaomi.smarthome APPV/62830"
-        self.locale = locale.getdefaultlocale()[0]
-
-        timezone = datetime.datetime.now(tzlocal.get_localzone()).strftime('%z')
-        timezone = "GMT{0}:{1}".format(timezone[:-2], timezone[-2:])
-        self.timezone = timezone
+        self.agent_id = fcutils.get_agent_id()
+        self.useragent = fcutils.get_useragent()
+        self.locale = fcutils.get_locale()
+        self.timezone = fcutils.get_timezone()
 
         self.default_server = 'de' # Sets default server to Europe.
         self.username = username
         self.password = password
         if not self._check_credentials():
             raise FcCloudException("username or password can't be empty")
+        self.limiter = get_pool().limiter(f"{self.api_host}/{username}")
 
         self.client_id = fcutils.get_random_string(6)
 
@@ -74,7 +80,7 @@ class FcCloud():
             self.service_token = None
             if self.failed_logins > 10:
                 logging.info("Repeated errors logging on to Xiaomi cloud. Cleaning stored cookies")
-                self.self._init_session(reset=True)
+                self._init_session(reset=True)
             return False
         except FcCloudAccessDenied as e:
             logging.info("Access denied when logging on to Xiaomi cloud (%s): %s", self.failed_logins, str(e))
@@ -82,7 +88,7 @@ class FcCloud():
             self.service_token = None
             if self.failed_logins > 10:
                 logging.info("Repeated errors logging on to Xiaomi cloud. Cleaning stored cookies")
-                self.self._init_session(reset=True)
+                self._init_session(reset=True)
             raise e
         except:
             logging.exception("Unknown exception occurred!")
@@ -91,27 +97,64 @@ class FcCloud():
         return True
 
     def _init_session(self, reset=False):
-        if not self.session or reset:
-            self.session = requests.Session()
-            self.session.headers.update({'appid': 'c2a51810216243f69a55571973f1b5d7'})
-            self.session.headers.update({'platform': 'hass'})
-            self.session.headers.update({'User-Agent': self.useragent})
-            self.session.cookies.update({
-                'sdkVersion': '3.8.6',
-                'deviceId': self.client_id
-            })
-            
+        if reset:
+            # Pooled sessions keep no cookies, and other clients use this one:
+            # a client starting over gets a session of its own.
+            self.session = get_pool().private_http_session()
+        elif not self.session:
+            # Shared by every client of this API host.
+            self.session = get_pool().http_session(self.api_host)
+
+    def _post(self, api, post_data, lane=STATE, stream=False):
+        """Post json to a cloud api, recording its latency and failures.
+
+        The call waits for a token of the account's scheduler in `lane`,
+        a `lane` of None goes around it, e.g. for health probes.
+        Raises RateLimitTimeout or CircuitOpenError, both OSErrors, without
+        calling when no token comes in time or while the API host is failing.
+        """
+        url = f"{self.api_host}/speaker/{api}"
+        if lane is not None:
+            try:
+                waited = self.limiter.acquire(lane)
+            except OSError:
+                self.metrics.inc(f"cloud.{api}.throttled")
+                raise
+            self.metrics.observe(f"ratelimit.{LANE_NAMES[lane]}.wait", waited)
+        try:
+            self.breaker.before_call()
+        except OSError:
+            self.metrics.inc(f"cloud.{api}.rejected")
+            raise
+        started = time.monotonic()
+        try:
+            with self.metrics.timer(f"cloud.{api}"):
+                response = self.session.post(
+                    url,
+                    data = json.dumps(post_data),
+                    headers = {'content-type': 'application/json'},
+                    cookies = {'sdkVersion': '3.8.6', 'deviceId': self.client_id},
+                    timeout = REQUEST_TIMEOUT,
+                    stream = stream,
+                )
+        except Exception:
+            self.breaker.record(False)
+            raise
+        # Client errors, e.g. a refused token, say nothing of the host health.
+        self.breaker.record(response.status_code < 500, time.monotonic() - started)
+        if response.status_code != 200:
+            self.metrics.inc(f"cloud.{api}.failures")
+        return response
+
     def _login(self):
-        url = "http://10.0.0.176:2018/speaker/oauth2/loginPassword"
         post_data = {
             'countrycode': 86,
             'phone': self.username,
             'password': hashlib.md5(self.password.encode(encoding='UTF-8')).hexdigest()
         }
         
-        self.session.headers.update({'content-type': 'application/json'})
-
-        response = self.session.post(url, data = json.dumps(post_data))
+        # Commands wait for the login, so it goes first.
+        response = self._post('oauth2/loginPassword', post_data, INTERACTIVE)
         response_json = json.loads(response.text.replace("&&&START&&&", ""))
 
         user_data = response_json['data']
@@ -127,19 +170,136 @@ class FcCloud():
     
 
 
-    def get_devices(self, country=None, raw=False, save=False):
+    def get_devices(self, country=None, raw=False, save=False, page=None, page_size=None, stream=False, lane=DEVICES):
+        """Request the device list, one page of it when `page` is given.
 
-        url = "http://10.0.0.176:2018/speaker/device/getUserDevice"
+        With `stream` the body is left unread, for core.jsonstream.
+        """
         post_data = {
             'token': 86,
             'userId': self.user_id,
             'platform': 'HomeAssistant'
         }
-        
-        self.session.headers.update({'content-type': 'application/json'})
+        if page is not None:
+            post_data.update({'pageNo': page, 'pageSize': page_size})
 
-        response = self.session.post(url, data = json.dumps(post_data))
+        response = self._post('device/getUserDevice', post_data, lane, stream)
 
         return response
 
+    def iter_devices(self, page_size=DEVICE_PAGE_SIZE):
+        """Yield the devices of every page of the list, parsing each page as it downloads.
+
+        Paging goes on until the `total` of the response is reached, or
+        without one until a page is empty or brings no new device: a
+        server may cap the page size below `page_size`, and one ignoring
+        paging repeats the whole list on the second page. Raises
+        FcCloudException when a page fails or is not valid JSON.
+        """
+        ids = set()
+        page = 1
+        while True:
+            response = self.get_devices(page=page, page_size=page_size, stream=True)
+            fields = {}
+            with response:
+                if response.status_code != 200:
+                    raise FcCloudException(f'device list page {page} returned {response.status_code}')
+                new = 0
+                try:
+                    for dev in iter_items(response.iter_content(16384), 'data', fields):
+                        if not isinstance(dev, dict) or dev.get('id') in ids:
+                            continue
+                        ids.add(dev.get('id'))
+                        new += 1
+                        yield dev
+                except ValueError as exc:
+                    raise FcCloudException(f'invalid device list page {page}: {exc}') from exc
+            total = fields.get('total')
+            if not new or (isinstance(total, int) and len(ids) >= total):
+                return
+            page += 1
+
+
+    def request_miot_api(self, api, data=None, lane=STATE):
+        post_data = dict(data or {})
+        post_data.update({
+            'userId': self.user_id,
+            'token': self.service_token,
+        })
+
+        response = self._post(api, post_data, lane)
+        if response.status_code != 200:
+            logging.warning("Fingercrystal cloud request %s failed: %s", api, response.status_code)
+            return None
+        return json.loads(response.text.replace("&&&START&&&", ""))
+
+    def get_props(self, params=None):
+        return self.request_miot_spec('prop/get', params)
+
+    def set_props(self, params=None):
+        return self.request_miot_spec('prop/set', params, INTERACTIVE)
+
+    def do_action(self, params=None):
+        return self.request_miot_spec('action', params, INTERACTIVE)
+
+    def request_miot_spec(self, api, params=None, lane=STATE):
+        rdt = self.request_miot_api('miotspec/' + api, {
+            'params': params or [],
+        }, lane) or {}
+        return rdt.get('result')
+
+
+    def get_device_events(self, did, since=0, limit=50, lane=BACKGROUND):
+        """Request a page of the events of a device, in the background lane by default."""
+        post_data = {
+            'userId': self.user_id,
+            'deviceId': did,
+            'startTime': since,
+            'pageSize': limit,
+            'platform': 'HomeAssistant'
+        }
+
+        response = self._post('device/getDeviceEvent', post_data, lane)
+
+        return response
+
+    def iter_device_events(self, did, since=0, limit=50):
+        """Yield the events of a device newer than `since` (ms), a page of `limit` at a time.
+
+        Events may share the millisecond a page ends on, so the next page
+        starts on that millisecond again, and the events of it already
+        yielded are skipped by id. A page holding nothing new is asked for
+        again twice as large. Raises FcCloudException when a page fails.
+        """
+        # Keys of the events yielded at time `since`, None before the first page.
+        seen = None
+        size = limit
+        while True:
+            start = since if seen is None else max(since - 1, 0)
+            response = self.get_device_events(did, start, size)
+            if response.status_code != 200:
+                raise FcCloudException(f'events of {did} returned {response.status_code}')
+            rls = json.loads(response.text.replace("&&&START&&&", "")).get('data') or []
+            last = since
+            at_last = set() if seen is None else seen
+            new = 0
+            for evt in rls:
+                t = int(evt.get('t') or 0)
+                key = evt.get('id') or (t, json.dumps(evt.get('data'), sort_keys=True, default=str))
+                if t <= since and seen is not None and key in seen:
+                    continue
+                if t > last:
+                    last, at_last = t, set()
+                if t == last:
+                    at_last.add(key)
+                new += 1
+                yield evt
+            if len(rls) < size:
+                return
+            if not new:
+                # A full page of events of one millisecond, all yielded before.
+                size *= 2
+                continue
+            since, seen, size = last, at_last, limit
+
 
@@ -1,5 +1,6 @@
 """Fc Open IOT HUB which base on MQTT."""
 import json
+import ssl
 import threading
 import time
 import uuid
@@ -8,72 +9,194 @@ from urllib.parse import urlsplit
 import logging
 
 from paho.mqtt import client as mqtt
-from requests.exceptions import RequestException
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from .metrics import Metrics
 
 
 LINK_ID = f"Fc-iot-app-sdk-python.{uuid.uuid1()}"
 GCM_TAG_LENGTH = 16
 CONNECT_FAILED_NOT_AUTHORISED = 5
+# The MQTT 5 reason code of the same.
+CONNECT_NOT_AUTHORIZED_V5 = 135
 
 _LOGGER = logging.getLogger(__name__)
 
 HOST = "106.55.145.207"
 PORT = 1883
+TLS_PORT = 8883
+KEEPALIVE = 60
+# The broker requires a new connection every 2 hours.
+RECONNECT_INTERVAL = 2 * 60 * 60
+STOP_TIMEOUT = 5.0
+TOPIC_PREFIX = "smartLock/homeassistant/"
+MQTT_V311 = 4
+MQTT_V5 = 5
+# How long the broker keeps an MQTT 5 persistent session of a gone client.
+SESSION_EXPIRY = 24 * 60 * 60
+
+
+def device_topic(did) -> str:
+    """Return the topic a lock publishes its messages to."""
+    return f"{TOPIC_PREFIX}{did}"
+
+
+def decode_message(payload: bytes):
+    """Decode a lock message payload, return None when it carries no data."""
+    return check_message(json.loads(payload.decode("utf8")))
+
+
+def check_message(msg_dict):
+    """Return an already parsed lock message, or None when it carries no data."""
+    if not isinstance(msg_dict, dict) or msg_dict.get("data") is None:
+        return None
+    return msg_dict
+
 
 class FcMQConfig:
     """fc mqtt config."""
 
-    def __init__(self, rollerid: str, username, password=None) -> None:
+    def __init__(
+        self, rollerid: str, username, password=None, host=None, port=None,
+        tls=False, ca_certs=None, keepalive=KEEPALIVE, clean_session=False,
+        share_group=None, protocol=MQTT_V311,
+    ) -> None:
         """Init FcMQConfig."""
         self.client_id = rollerid
         self.username = "smartLock"
         self.password = "abc123456"
+        self.host = host or HOST
+        self.port = port or (TLS_PORT if tls else PORT)
+        self.tls = tls
+        self.ca_certs = ca_certs
+        self.keepalive = keepalive or KEEPALIVE
+        # A persistent session keeps subscriptions and queued QoS1 messages
+        # on the broker while we are disconnected.
+        self.clean_session = clean_session
+        # Subscribe as a member of this shared subscription group, see core.workers.
+        self.share_group = share_group or None
+        self.protocol = protocol or MQTT_V311
+
+    def topic_filter(self, topic) -> str:
+        """Return the filter to subscribe to `topic` with, shared when in a group."""
+        if self.share_group:
+            return f"$share/{self.share_group}/{topic}"
+        return topic
+
+
+class ResumableSSLContext(ssl.SSLContext):
+    """SSL context offering the last TLS session again, to resume it on reconnect."""
+
+    session = None
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if self.session is not None:
+            kwargs.setdefault('session', self.session)
+        return super().wrap_socket(sock, *args, **kwargs)
+
+    @staticmethod
+    def create(ca_certs=None):
+        ctx = ResumableSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        if ca_certs:
+            ctx.load_verify_locations(ca_certs)
+        else:
+            ctx.load_default_certs()
+        return ctx
 
 
 class FcOpenMQ(threading.Thread):
+    """MQTT connection receiving the messages of one or more locks.
+
+    By default it subscribes to the lock `rollerid` only. Given `devices`, it
+    uses `rollerid` as client id and subscribes to those devices, which can
+    be changed later with add_device/remove_device, so several locks share
+    one connection.
 
-    def __init__(self, rollerid: str, username, password=None) -> None:
+    With the `share_group` option it subscribes as a member of that MQTT
+    shared subscription group, and `protocol=5` connects with MQTT 5.
+    """
+
+    def __init__(
+        self, rollerid: str, username, password=None, host=None, port=None,
+        metrics=None, recorder=None, devices=None, **options,
+    ) -> None:
         """Init FcOpenMQ."""
         threading.Thread.__init__(self)
         self._stop_event = threading.Event()
         self.client = None
-        self.mq_config = FcMQConfig(rollerid, username, password)
+        self.metrics = metrics or Metrics()
+        self.recorder = recorder
+        self.mq_config = FcMQConfig(rollerid, username, password, host, port, **options)
+        self._ssl_context = ResumableSSLContext.create(self.mq_config.ca_certs) if self.mq_config.tls else None
         self.message_listeners = set()
-
-    def _on_disconnect(self, client, userdata, rc):
+        self.connect_listeners = set()
+        self.device_listeners = {}
+        self._connected_once = False
+        self._topics_lock = threading.Lock()
+        self._topics = {device_topic(did) for did in (devices if devices is not None else [rollerid])}
+        self._subscribed = set()
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         if rc != 0:
-            _LOGGER.error(f"Unexpected disconnection.{rc}")
+            self.metrics.inc("mqtt.disconnects")
+            _LOGGER.warning("Unexpected disconnection of %s: %s", self.mq_config.client_id, rc)
         else:
-            _LOGGER.error("disconnect")
+            _LOGGER.debug("disconnect")
 
-    def _on_connect(self, mqttc: mqtt.Client, user_data: Any, flags, rc):
-        _LOGGER.error(f"connect flags->{flags}, rc->{rc}")
+    def _on_connect(self, mqttc: mqtt.Client, user_data: Any, flags, rc, properties=None):
+        _LOGGER.debug("connect flags->%s, rc->%s", flags, rc)
+        self.metrics.inc("mqtt.connects" if rc == 0 else "mqtt.connect_failures")
         if rc == 0:
             mq_config = user_data["mqConfig"]
-            mqttc.subscribe(f"smartLock/homeassistant/{mq_config.client_id}")
-        elif rc == CONNECT_FAILED_NOT_AUTHORISED:
+            sock = mqttc.socket()
+            if self._ssl_context and isinstance(sock, ssl.SSLSocket):
+                self._ssl_context.session = sock.session
+            with self._topics_lock:
+                # A resumed persistent session still has our subscriptions.
+                if mq_config.clean_session or not flags.get("session present"):
+                    self._subscribed = set()
+                topics = self._topics - self._subscribed
+                self._subscribed |= topics
+            if topics:
+                mqttc.subscribe([(mq_config.topic_filter(topic), 1) for topic in sorted(topics)])
+            reconnect = self._connected_once
+            self._connected_once = True
+            if reconnect:
+                self.metrics.inc("mqtt.reconnects")
+            for listener in list(self.connect_listeners):
+                listener(reconnect)
+        elif rc in (CONNECT_FAILED_NOT_AUTHORISED, CONNECT_NOT_AUTHORIZED_V5):
             self.__run_mqtt()
 
     def _on_message(self, mqttc: mqtt.Client, user_data: Any, msg: mqtt.MQTTMessage):
-        _LOGGER.error(f"payload-> {msg.payload}")
-
-        msg_dict = json.loads(msg.payload.decode("utf8"))
-
-        t = msg_dict.get("t", "")
-
-        if msg_dict["data"] is None:
+        _LOGGER.debug("payload-> %s", msg.payload)
+        self.metrics.inc("mqtt.messages")
+        if self.recorder is not None:
+            self.recorder.record(msg.topic, msg.payload)
+
+        try:
+            msg_dict = decode_message(msg.payload)
+        except (UnicodeDecodeError, ValueError) as exc:
+            self.metrics.inc("mqtt.decode_failures")
+            _LOGGER.warning("Invalid payload on %s: %s", msg.topic, exc)
             return
 
-        _LOGGER.error(f"on_message: {msg_dict}")
+        if msg_dict is None:
+            return
 
+        started = time.perf_counter()
         for listener in self.message_listeners:
             listener(msg_dict)
+        for listener in list(self.device_listeners.get(msg.topic.rsplit("/", 1)[-1], ())):
+            listener(msg_dict)
+        self.metrics.observe("mqtt.dispatch.latency", time.perf_counter() - started)
 
-    def _on_subscribe(self, mqttc: mqtt.Client, user_data: Any, mid, granted_qos):
-        _LOGGER.error(f"_on_subscribe: {mid}")
+    def _on_subscribe(self, mqttc: mqtt.Client, user_data: Any, mid, granted_qos, properties=None):
+        _LOGGER.debug("_on_subscribe: %s", mid)
 
     def _on_log(self, mqttc: mqtt.Client, user_data: Any, level, string):
-        _LOGGER.error(f"_on_log: {string}")
+        _LOGGER.debug("_on_log: %s", string)
 
     def run(self):
         """Method representing the thread's activity which should not be used directly."""
@@ -83,14 +206,17 @@ class FcOpenMQ(threading.Thread):
                 self.__run_mqtt()
                 backoff_seconds = 1
 
-                # reconnect every 2 hours required.
-                time.sleep(2*60*60)
-            except RequestException as e:
+                # reconnect every 2 hours required, stop() ends the wait at once.
+                self._stop_event.wait(RECONNECT_INTERVAL)
+            except OSError as e:
                 _LOGGER.exception(e)
                 _LOGGER.error(f"failed to refresh mqtt server, retrying in {backoff_seconds} seconds.")
 
-                time.sleep(backoff_seconds)
+                self._stop_event.wait(backoff_seconds)
                 backoff_seconds = min(backoff_seconds * 2 , 60) # Try at most every 60 seconds to refresh
+        # stop() may have run while a client was connecting.
+        self._close_client(self.client)
+        self.client = None
 
 
     def __run_mqtt(self):
@@ -100,13 +226,25 @@ class FcOpenMQ(threading.Thread):
 
         mqttc = self._start(self.mq_config)
 
-        if self.client:
-            self.client.disconnect()
-        self.client = mqttc
+        old, self.client = self.client, mqttc
+        self._close_client(old)
+
+    @staticmethod
+    def _close_client(client):
+        """Disconnect a client and join its paho network thread."""
+        if client is None:
+            return
+        client.disconnect()
+        client.loop_stop()
 
     def _start(self, mq_config: FcMQConfig) -> mqtt.Client:
-        mqttc = mqtt.Client(mq_config.client_id)
+        if mq_config.protocol == MQTT_V5:
+            mqttc = mqtt.Client(mq_config.client_id, protocol=mqtt.MQTTv5)
+        else:
+            mqttc = mqtt.Client(mq_config.client_id, clean_session=mq_config.clean_session)
         mqttc.username_pw_set(mq_config.username, mq_config.password)
+        if self._ssl_context:
+            mqttc.tls_set_context(self._ssl_context)
         mqttc.user_data_set({"mqConfig": mq_config})
         mqttc.on_connect = self._on_connect
         mqttc.on_message = self._on_message
@@ -114,7 +252,16 @@ class FcOpenMQ(threading.Thread):
         mqttc.on_log = self._on_log
         mqttc.on_disconnect = self._on_disconnect
 
-        mqttc.connect(HOST, PORT, 60)
+        if mq_config.protocol == MQTT_V5:
+            props = Properties(PacketTypes.CONNECT)
+            if not mq_config.clean_session:
+                props.SessionExpiryInterval = SESSION_EXPIRY
+            mqttc.connect(
+                mq_config.host, mq_config.port, mq_config.keepalive,
+                clean_start=mq_config.clean_session, properties=props,
+            )
+        else:
+            mqttc.connect(mq_config.host, mq_config.port, mq_config.keepalive)
 
         mqttc.loop_start()
         return mqttc
@@ -127,16 +274,22 @@ class FcOpenMQ(threading.Thread):
         _LOGGER.debug("start")
         super().start()
 
-    def stop(self):
+    def stop(self, timeout=STOP_TIMEOUT) -> bool:
         """Stop mqtt.
 
-        Stop mqtt thread
+        Remove the listeners, disconnect, and join the paho and mqtt threads
+        for up to `timeout` seconds. Returns True once both threads ended.
         """
         _LOGGER.debug("stop")
         self.message_listeners = set()
-        self.client.disconnect()
-        self.client = None
+        self.connect_listeners = set()
+        self.device_listeners = {}
         self._stop_event.set()
+        client, self.client = self.client, None
+        self._close_client(client)
+        if self.ident is not None and self is not threading.current_thread():
+            self.join(timeout)
+        return not self.is_alive()
 
     def add_message_listener(self, listener: Callable[[str], None]):
         """Add mqtt message listener."""
@@ -145,3 +298,55 @@ class FcOpenMQ(threading.Thread):
     def remove_message_listener(self, listener: Callable[[str], None]):
         """Remvoe mqtt message listener."""
         self.message_listeners.discard(listener)
+
+    def add_device(self, did, listener: Callable[[dict], None] = None):
+        """Receive the messages of a lock, passing them to `listener`."""
+        topic = device_topic(did)
+        if listener is not None:
+            self.device_listeners.setdefault(str(did), set()).add(listener)
+        with self._topics_lock:
+            new = topic not in self._topics
+            self._topics.add(topic)
+            client = self.client
+            if new and client is not None and client.is_connected():
+                self._subscribed.add(topic)
+            else:
+                client = None
+        if client is not None:
+            client.subscribe(self.mq_config.topic_filter(topic), qos=1)
+
+    def remove_device(self, did, listener: Callable[[dict], None] = None):
+        """Stop passing a lock's messages to `listener`, unsubscribe when none is left."""
+        lss = self.device_listeners.get(str(did), set())
+        lss.discard(listener)
+        if lss:
+            return
+        self.device_listeners.pop(str(did), None)
+        topic = device_topic(did)
+        with self._topics_lock:
+            self._topics.discard(topic)
+            subscribed = topic in self._subscribed
+            self._subscribed.discard(topic)
+            client = self.client
+        if subscribed and client is not None:
+            client.unsubscribe(self.mq_config.topic_filter(topic))
+
+    def devices(self) -> set:
+        """Return the ids of the locks listened to."""
+        with self._topics_lock:
+            return {topic[len(TOPIC_PREFIX):] for topic in self._topics}
+
+    def queue_depth(self) -> int:
+        """Return the number of QoS>0 messages in flight on the current client."""
+        client = self.client
+        if client is None:
+            return 0
+        return len(getattr(client, "_out_messages", ())) + len(getattr(client, "_in_messages", ()))
+
+    def add_connect_listener(self, listener: Callable[[bool], None]):
+        """Add mqtt connect listener, called with True when it is a reconnect."""
+        self.connect_listeners.add(listener)
+
+    def remove_connect_listener(self, listener: Callable[[bool], None]):
+        """Remove mqtt connect listener."""
+        self.connect_listeners.discard(listener)
@@ -3,12 +3,38 @@ import time
 import random
 import hashlib, hmac, base64
 import string
+import locale
+import datetime
+from functools import lru_cache
 from urllib.parse import urlparse
-from Crypto.Cipher import ARC4
 
 from .fccloudexception import FcCloudException
 
 
+# The environment does not change while the process runs, so it is probed
+# once and shared by every client.
+@lru_cache(maxsize=None)
+def get_locale():
+    return locale.getdefaultlocale()[0]
+
+
+@lru_cache(maxsize=None)
+def get_timezone():
+    import tzlocal  # pylint: disable=import-outside-toplevel
+    timezone = datetime.datetime.now(tzlocal.get_localzone()).strftime('%z')
+    return "GMT{0}:{1}".format(timezone[:-2], timezone[-2:])
+
+
+@lru_cache(maxsize=None)
+def get_agent_id():
+    return get_random_agent_id()
+
+
+@lru_cache(maxsize=None)
+def get_useragent():
+    return "Android-7.1.1-1.0.0-ONEPLUS A3010-136-" + get_agent_id() + " APP/xiaomi.smarthome APPV/62830"
+
+
 def get_random_agent_id():
     letters = 'ABCDEF'
     result_str = ''.join(random.choice(letters) for i in range(13))
@@ -97,12 +123,14 @@ def generate_enc_params(url, method, signed_nonce, nonce, params, ssecurity):
 
 
 def encrypt_rc4(password, payload):
+    from Crypto.Cipher import ARC4  # pylint: disable=import-outside-toplevel
     r = ARC4.new(base64.b64decode(password))
     r.encrypt(bytes(1024))
     return base64.b64encode(r.encrypt(payload.encode())).decode()
 
 
 def decrypt_rc4(password, payload):
+    from Crypto.Cipher import ARC4  # pylint: disable=import-outside-toplevel
     r = ARC4.new(base64.b64decode(password))
     r.encrypt(bytes(1024))
     return r.encrypt(base64.b64decode(payload))
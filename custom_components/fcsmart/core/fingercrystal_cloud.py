@@ -1,18 +1,11 @@
 import logging
-import json
 import time
-import base64
-import hashlib
-import requests
 from datetime import datetime
-from functools import partial
-from urllib.parse import urlparse
 
-from homeassistant.const import *
 from homeassistant.helpers.storage import Store
-from homeassistant.components import persistent_notification
 
-from .fccloud import FcCloud
+from . import endpoints
+from .fccloud import DEVICE_PAGE_SIZE, FcCloud
 from .fccloudexception import FcCloudException
 
 try:
@@ -23,12 +16,18 @@ except (ModuleNotFoundError, ImportError):
 
 _LOGGER = logging.getLogger(__name__)
 
+DATA_SESSIONS = 'fcsmart_sessions'
+SESSION_TTL = 12 * 3600
+DEVICE_BATCH = 50
+
 
 class FiotCloud(FcCloud):
-    def __init__(self, hass, username, password, country=None):
-        super().__init__(username, password)
+    def __init__(self, hass, username, password, country=None, eps=None):
+        super().__init__(username, password, api_host=eps.api if eps else None)
         self.hass = hass
         self.default_server = country or 'cn'
+        self.endpoints = eps
+        self.login_time = 0
         self.http_timeout = 10
         self.attrs = {}
 
@@ -56,21 +55,6 @@ class FiotCloud(FcCloud):
             dls.append(v)
         return dls
 
-    def get_props(self, params=None):
-        return self.request_miot_spec('prop/get', params)
-
-    def set_props(self, params=None):
-        return self.request_miot_spec('prop/set', params)
-
-    def do_action(self, params=None):
-        return self.request_miot_spec('action', params)
-
-    def request_miot_spec(self, api, params=None):
-        rdt = self.request_miot_api('miotspec/' + api, {
-            'params': params or [],
-        }) or {}
-        return rdt.get('result')
-
     async def async_get_device(self, mac=None, host=None):
         dvs = await self.async_get_devices() or []
         for d in dvs:
@@ -82,19 +66,44 @@ class FiotCloud(FcCloud):
                 return d
         return None
 
-    def get_device_list(self):
-    
-        response = self.get_devices()
-       
-        if response.status_code == 200:
-            response_json = json.loads(response.text.replace("&&&START&&&", ""))
-            dvs = response_json['data']
-            return dvs
-        else:
-            _LOGGER.warning('Got fingercrystal cloud devices for %s failed: %s', self.username, rdt)
+    def get_device_list(self, on_batch=None, page_size=DEVICE_PAGE_SIZE):
+        """Return all devices, parsing each page as it downloads.
+
+        `on_batch(devices)` receives the devices in batches as soon as they
+        are parsed. Returns None when a page fails, so a partial list never
+        replaces the cached one.
+        """
+        dvs = []
+        batch = []
+        try:
+            for dev in self.iter_devices(page_size):
+                batch.append(dev)
+                if len(batch) >= DEVICE_BATCH:
+                    dvs.extend(batch)
+                    if on_batch:
+                        on_batch(batch)
+                    batch = []
+        except FcCloudException as exc:
+            _LOGGER.warning('Got fingercrystal cloud devices for %s failed: %s', self.username, exc)
             return None
+        if batch:
+            dvs.extend(batch)
+            if on_batch:
+                on_batch(batch)
+        return dvs
+
+    async def async_cached_devices(self):
+        """Return the devices of the last download, whatever their age."""
+        fnm = f'fingercrystal_fiot/devices-{self.user_id}-{self.default_server}.json'
+        dat = await Store(self.hass, 1, fnm).async_load() or {}
+        return (dat.get('devices') or []) if isinstance(dat, dict) else []
 
-    async def async_get_devices(self, renew=False):
+    async def async_get_devices(self, renew=False, on_batch=None):
+        """Return the devices, from the day old cache unless `renew`.
+
+        Devices downloaded are also passed in batches to the `on_batch`
+        callback, run in the event loop, as they arrive.
+        """
         if not self.user_id:
             return None
         fnm = f'fingercrystal_fiot/devices-{self.user_id}-{self.default_server}.json'
@@ -108,7 +117,10 @@ class FiotCloud(FcCloud):
         dvs = None if renew else cds
         if not dvs:
             try:
-                dvs = await self.hass.async_add_executor_job(self.get_device_list)
+                dvs = await self.hass.async_add_executor_job(
+                    self.get_device_list,
+                    (lambda batch: self.hass.add_job(on_batch, batch)) if on_batch else None,
+                )
                 if dvs:                   
                     dat = {
                         'update_time': now,
@@ -117,11 +129,44 @@ class FiotCloud(FcCloud):
                     }
                     await store.async_save(dat)
                     _LOGGER.info('Got %s devices from fingercrystal cloud', len(dvs))
-            except requests.exceptions.ConnectionError as exc:
+            except OSError as exc:  # requests.ConnectionError is an OSError
                 dvs = cds
                 _LOGGER.warning('Get fingercrystal devices filed: %s, use cached %s devices.', exc, len(cds))
         return dvs
 
+    def backfill_event_list(self, did, since=0, batch_size=50, max_events=1000):
+        """Return up to `max_events` events of a device newer than `since`, oldest first.
+
+        Pages of `batch_size` come from `iter_device_events`, which keeps the
+        events sharing the millisecond a page ends on. A failing page ends the
+        list, keeping the events fetched before it.
+        """
+        evs = []
+        try:
+            for evt in self.iter_device_events(did, since, batch_size):
+                evs.append(evt)
+                if len(evs) >= max_events:
+                    break
+        except (OSError, ValueError, FcCloudException) as exc:  # ValueError: invalid JSON
+            _LOGGER.warning('Backfill fingercrystal events for %s failed: %s', did, exc)
+        evs.sort(key=lambda e: int(e.get('t') or 0))
+        return evs
+
+    async def async_backfill_events(self, did, since, batch_size=50, max_batches=20):
+        """Fetch lock events of a device newer than the cursor `since`, in batches."""
+        return await self.hass.async_add_executor_job(
+            self.backfill_event_list, did, since, batch_size, batch_size * max_batches,
+        )
+
+    async def async_event_cursors(self, cursors=None):
+        """Load, or save when `cursors` is given, the per device event cursors."""
+        fnm = f'fingercrystal_fiot/events-{self.user_id}-{self.default_server}.json'
+        store = Store(self.hass, 1, fnm)
+        if cursors is None:
+            return await store.async_load() or {}
+        await store.async_save(cursors)
+        return cursors
+
     async def async_renew_devices(self):
         return await self.async_get_devices(renew=True)
 
@@ -144,11 +189,13 @@ class FiotCloud(FcCloud):
         response = self._login()
        
         if response.status_code == 200:
+            self.login_time = time.time()
             return True
         else:
+            self.login_time = 0
             _LOGGER.warning(
                 'Xiaomi login request returned status %s, reason: %s, content: %s',
-                response.status_code, response3.reason, response3.text,
+                response.status_code, response.reason, response.text,
             )
             raise FcCloudAccessDenied('Access denied. Did you set the correct username/password ?')
 
@@ -162,13 +209,53 @@ class FiotCloud(FcCloud):
             'ssecurity': self.ssecurity,
         }
 
+    @staticmethod
+    def resolve_endpoints(config: dict):
+        """Return the endpoints of `config`, the default hosts unless it overrides them."""
+        return endpoints.resolve(config)
+
+    def session_valid(self):
+        """Return True while the token of the last login can be reused."""
+        return bool(self.user_id and self.service_token) and time.time() - self.login_time < SESSION_TTL
+
+    @staticmethod
+    def session_key(config: dict):
+        # Entries of one account on other API hosts log in there on their own.
+        return config.get('username'), config.get('server_country') or 'cn', config.get('api_host') or None
+
+    @staticmethod
+    async def async_get_session(hass, config: dict):
+        """Return a logged in client for the account of `config`.
+
+        Clients are cached per username, server and API host, so the config
+        flow hands its login over to entry setup, and reloads skip logging in
+        again while the token is valid.
+        """
+        sessions = hass.data.setdefault(DATA_SESSIONS, {})
+        key = FiotCloud.session_key(config)
+        fcc = sessions.get(key)
+        if fcc and fcc.password == config.get('password') and fcc.session_valid():
+            return fcc
+        fcc = await FiotCloud.from_token(hass, config, login=False)
+        await fcc.async_login()
+        await fcc.async_stored_auth(fcc.user_id, save=True)
+        sessions[key] = fcc
+        return fcc
+
+    @staticmethod
+    def drop_session(hass, config: dict):
+        """Forget the cached client of an account, e.g. when its token is refused."""
+        hass.data.get(DATA_SESSIONS, {}).pop(FiotCloud.session_key(config), None)
+
     @staticmethod
     async def from_token(hass, config: dict, login=True):
+        eps = FiotCloud.resolve_endpoints(config)
         fcc = FiotCloud(
             hass,
             config.get('username'),
             config.get('password'),
             config.get('server_country'),
+            eps,
         )
         fcc.user_id = str(config.get('user_id') or '')
         sdt = await fcc.async_stored_auth(fcc.user_id, save=False)
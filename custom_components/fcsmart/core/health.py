@@ -0,0 +1,134 @@
+"""Concurrent health probe of the cloud API, the device list and the MQTT broker.
+
+    python -m core.health --api http://host:port --mqtt host:1883
+"""
+import argparse
+import json
+import ssl
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .endpoints import DEFAULT_MQTT_PORT
+from .fcmq import TOPIC_PREFIX
+from .pool import CLIENT_ID_PREFIX, get_pool
+
+TIMEOUT = 5
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def probe_api(api_host, timeout=TIMEOUT):
+    """Time a login round trip without credentials, any HTTP answer means reachable."""
+    started = time.perf_counter()
+    rsp = get_pool().http_session(api_host).post(
+        f'{api_host}/speaker/oauth2/loginPassword', json={}, timeout=timeout,
+    )
+    return {'latency_ms': _ms(time.perf_counter() - started), 'status': rsp.status_code}
+
+
+def probe_devices(fc_cloud):
+    """Time a one device page of the list of a logged in client.
+
+    The request goes around the account's scheduler, so periodic probes
+    take nothing of the budget of real requests.
+    """
+    started = time.perf_counter()
+    rsp = fc_cloud.get_devices(page=1, page_size=1, lane=None)
+    if rsp.status_code != 200:
+        raise OSError(f'device list returned {rsp.status_code}')
+    return {'latency_ms': _ms(time.perf_counter() - started)}
+
+
+def probe_mqtt(host, port=None, tls=False, timeout=TIMEOUT):
+    """Time the connect and subscribe of a throwaway clean session."""
+    import paho.mqtt.client as mqtt  # pylint: disable=import-outside-toplevel
+    connected = threading.Event()
+    subscribed = threading.Event()
+    result = {}
+    client = mqtt.Client(client_id=f'{CLIENT_ID_PREFIX}-probe-{uuid.uuid4().hex[:6]}', clean_session=True)
+    client.username_pw_set("smartLock", "abc123456")
+    if tls:
+        client.tls_set_context(ssl.create_default_context())
+
+    def on_connect(mqttc, userdata, flags, rc):
+        result['rc'] = rc
+        connected.set()
+        if rc == 0:
+            mqttc.subscribe(f'{TOPIC_PREFIX}health-probe', 0)
+
+    client.on_connect = on_connect
+    client.on_subscribe = lambda *args: subscribed.set()
+    started = time.perf_counter()
+    try:
+        client.connect(host, port or (8883 if tls else DEFAULT_MQTT_PORT), keepalive=max(10, timeout * 2))
+        client.loop_start()
+        if not connected.wait(timeout):
+            raise TimeoutError('no connack')
+        if result['rc']:
+            raise ConnectionRefusedError(f'connect refused: {mqtt.connack_string(result["rc"])}')
+        result['connect_ms'] = _ms(time.perf_counter() - started)
+        if not subscribed.wait(max(0.1, timeout - (time.perf_counter() - started))):
+            raise TimeoutError('no suback')
+        result['subscribe_ms'] = _ms(time.perf_counter() - started)
+    finally:
+        client.disconnect()
+        client.loop_stop()
+    result.pop('rc', None)
+    return result
+
+
+def run(api_host=None, mqtt_host=None, mqtt_port=None, tls=False, fc_cloud=None, timeout=TIMEOUT):
+    """Run the applicable probes concurrently, return a report.
+
+    The report has `ok`, the elapsed time and one entry per check with its
+    own `ok`, latencies and `error`. Checks still running at `timeout` are
+    reported as timed out.
+    """
+    checks = {}
+    if api_host:
+        checks['api'] = (probe_api, api_host, timeout)
+    if fc_cloud is not None and fc_cloud.user_id:
+        checks['devices'] = (probe_devices, fc_cloud)
+    if mqtt_host:
+        checks['mqtt'] = (probe_mqtt, mqtt_host, mqtt_port, tls, timeout)
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=len(checks) or 1, thread_name_prefix='fcsmart-health')
+    futures = {name: executor.submit(*args) for name, args in checks.items()}
+    wait(futures.values(), timeout=timeout + 1)
+    executor.shutdown(wait=False)
+    report = {}
+    for name, fut in futures.items():
+        if not fut.done():
+            report[name] = {'ok': False, 'error': f'timed out after {timeout}s'}
+            continue
+        try:
+            report[name] = {'ok': True, **fut.result()}
+        except Exception as exc:  # pylint: disable=broad-except
+            report[name] = {'ok': False, 'error': f'{type(exc).__name__}: {exc}'}
+    return {
+        'ok': all(chk['ok'] for chk in report.values()),
+        'elapsed_ms': _ms(time.perf_counter() - started),
+        'checks': report,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Probe the fingercrystal cloud and MQTT broker.')
+    parser.add_argument('--api')
+    parser.add_argument('--mqtt', help='host[:port]')
+    parser.add_argument('--tls', action='store_true')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT)
+    args = parser.parse_args(argv)
+    host, _, port = (args.mqtt or '').partition(':')
+    report = run(args.api, host or None, int(port) if port else None, args.tls, timeout=args.timeout)
+    print(json.dumps(report, indent=2))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
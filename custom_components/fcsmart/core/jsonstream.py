@@ -0,0 +1,116 @@
+"""Incremental parser for the `&&&START&&&`-prefixed JSON responses of the cloud API.
+
+`iter_items(chunks, key)` yields the elements of the array under the top
+level `key` as the chunks of the body arrive, keeping only the unparsed
+tail in memory.
+"""
+import codecs
+import json
+
+RESPONSE_PREFIX = "&&&START&&&"
+WHITESPACE = ' \t\n\r'
+# Characters a number cut short by a chunk boundary may go on with.
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+class _Reader:
+    """Text buffer fed from byte chunks, parsed with JSONDecoder.raw_decode."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf8')()
+        self._json = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            if self.pos > 65536:
+                self.buf = self.buf[self.pos:]
+                self.pos = 0
+            self.buf += self._decoder.decode(chunk)
+            return True
+        self.buf += self._decoder.decode(b'', final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """Return the next non blank character, without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('unexpected end of response')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'expected {char!r} at {self.pos}, got {self.buf[self.pos]!r}')
+        self.pos += 1
+
+    def skip_prefix(self):
+        while len(self.buf) - self.pos < len(RESPONSE_PREFIX) and self._fill():
+            pass
+        if self.buf.startswith(RESPONSE_PREFIX, self.pos):
+            self.pos += len(RESPONSE_PREFIX)
+
+    def value(self):
+        """Decode the next complete JSON value, reading more chunks as needed."""
+        self.peek()
+        while True:
+            try:
+                val, end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Incomplete value, unless the body is over.
+                if not self._fill():
+                    raise
+                continue
+            if not self.eof and self.buf[self.pos] not in '{["' and (
+                    end == len(self.buf) or self.buf[end] in NUMBER_CHARS):
+                # A number could go on in the next chunk, e.g. `1.` of `1.5`.
+                if self._fill():
+                    continue
+            self.pos = end
+            return val
+
+
+def iter_items(chunks, key='data', fields=None):
+    """Yield the elements of the array at top level `key` of a streamed response.
+
+    Other top level values are parsed and stored in `fields` when given.
+    """
+    rdr = _Reader(chunks)
+    rdr.skip_prefix()
+    rdr.expect('{')
+    if rdr.peek() == '}':
+        return
+    while True:
+        name = rdr.value()
+        rdr.expect(':')
+        if name == key and rdr.peek() == '[':
+            rdr.expect('[')
+            if rdr.peek() == ']':
+                rdr.pos += 1
+            else:
+                while True:
+                    yield rdr.value()
+                    if rdr.peek() == ',':
+                        rdr.pos += 1
+                        continue
+                    rdr.expect(']')
+                    break
+        else:
+            val = rdr.value()
+            if fields is not None:
+                fields[name] = val
+        if rdr.peek() == ',':
+            rdr.pos += 1
+            continue
+        rdr.expect('}')
+        return
@@ -0,0 +1,39 @@
+"""Parallel, deadline bound teardown of connections and threads."""
+import threading
+import time
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+DEADLINE = 10.0
+
+
+def stop_all(tasks, deadline=DEADLINE):
+    """Run the `(name, func)` stop tasks in parallel, waiting up to `deadline` seconds.
+
+    Returns `{name: reason}` for the tasks that raised or were still
+    running at the deadline; empty when everything stopped.
+    """
+    failures = {}
+    lock = threading.Lock()
+
+    def run(name, func):
+        try:
+            func()
+        except Exception as exc:  # pylint: disable=broad-except
+            with lock:
+                failures[name] = f'{type(exc).__name__}: {exc}'
+
+    ths = []
+    for name, func in tasks:
+        thd = threading.Thread(target=run, args=(name, func), name=f'fcsmart-stop-{name}', daemon=True)
+        thd.start()
+        ths.append((name, thd))
+    end = time.monotonic() + deadline
+    for name, thd in ths:
+        thd.join(max(0.0, end - time.monotonic()))
+    with lock:
+        for name, thd in ths:
+            if thd.is_alive():
+                failures.setdefault(name, f'still running after {deadline}s')
+        return dict(failures)
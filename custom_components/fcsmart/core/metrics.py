@@ -0,0 +1,136 @@
+"""Counters, gauges and latency histograms for the cloud and MQTT paths."""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, the last bucket is open ended.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def percentile(values, pct):
+    """Return the `pct` percentile of sorted `values` (nearest rank)."""
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))
+    return values[idx]
+
+
+class Histogram:
+    """Fixed bucket histogram, constant memory whatever the number of samples."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """Return the upper bound of the bucket holding the `pct` percentile."""
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, cnt in enumerate(self.counts):
+            seen += cnt
+            if seen >= rank and cnt:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.counts)),
+        }
+
+
+class Metrics:
+    """Thread safe registry shared by a hub, its cloud client and its MQTT clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._gauge_fns = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def gauge_fn(self, name, func):
+        """Register a gauge whose value is read from `func` when reported."""
+        with self._lock:
+            self._gauge_fns[name] = func
+
+    def observe(self, name, value):
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        """Time a block as `<name>.latency`, counting `<name>.requests` and `<name>.failures`."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f'{name}.failures')
+            raise
+        finally:
+            self.inc(f'{name}.requests')
+            self.observe(f'{name}.latency', time.perf_counter() - started)
+
+    def counter(self, name):
+        return self.counters.get(name, 0)
+
+    def gauge(self, name):
+        func = self._gauge_fns.get(name)
+        if func is not None:
+            try:
+                return func()
+            except Exception:  # pylint: disable=broad-except
+                return None
+        return self.gauges.get(name)
+
+    def histogram(self, name):
+        return self.histograms.get(name)
+
+    def total(self, prefix, suffix=''):
+        """Sum the counters whose name starts with `prefix` and ends with `suffix`."""
+        with self._lock:
+            return sum(v for k, v in self.counters.items() if k.startswith(prefix) and k.endswith(suffix))
+
+    def as_dict(self):
+        uptime = time.time() - self.started
+        with self._lock:
+            counters = dict(self.counters)
+            hists = {k: h.as_dict() for k, h in self.histograms.items()}
+            names = set(self.gauges) | set(self._gauge_fns)
+        return {
+            'uptime': uptime,
+            'counters': counters,
+            'rates': {k: v / uptime for k, v in counters.items()} if uptime else {},
+            'gauges': {k: self.gauge(k) for k in sorted(names)},
+            'histograms': hists,
+        }
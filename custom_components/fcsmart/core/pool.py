@@ -0,0 +1,158 @@
+"""Process wide pool of resources shared by all accounts and config entries.
+
+HTTP sessions and circuit breakers are shared per API host, request
+schedulers per account, MQTT connections per broker, and
+other shared objects (e.g. schedulers) per key given by the caller. Auth
+stays per client: tokens travel in the request bodies and cookies are not
+kept by pooled sessions.
+"""
+import http.cookiejar
+import socket
+import threading
+import uuid
+import logging
+
+from . import fcutils
+
+_LOGGER = logging.getLogger(__name__)
+
+# Stable per machine, so a pooled connection resumes its persistent session.
+CLIENT_ID_PREFIX = f"fcsmart-{uuid.uuid5(uuid.NAMESPACE_DNS, socket.gethostname()).hex[:12]}"
+
+
+def _new_http_session():
+    import requests  # pylint: disable=import-outside-toplevel
+    session = requests.Session()
+    session.headers.update({
+        'appid': 'c2a51810216243f69a55571973f1b5d7',
+        'platform': 'hass',
+        'User-Agent': fcutils.get_useragent(),
+    })
+    # Never keep cookies of one account for another.
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+class ResourcePool:
+    """Reference counted shared objects, keyed by kind and key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = {}
+
+    def acquire(self, kind, key, factory):
+        """Return the shared object, creating it with `factory` on first use."""
+        with self._lock:
+            item = self._items.get((kind, key))
+            if item is None:
+                item = self._items[(kind, key)] = [factory(), 0]
+            item[1] += 1
+            return item[0]
+
+    def release(self, kind, key, close=None):
+        """Drop a reference, closing the object with `close` when it was the last."""
+        with self._lock:
+            item = self._items.get((kind, key))
+            if item is None:
+                return False
+            item[1] -= 1
+            if item[1] > 0:
+                return False
+            self._items.pop((kind, key))
+        if close is not None:
+            close(item[0])
+        return True
+
+    def get(self, kind, key):
+        with self._lock:
+            item = self._items.get((kind, key))
+            return item[0] if item else None
+
+    def shared(self, kind, key, factory):
+        """Return an object kept for the process lifetime, created with `factory` on first use."""
+        with self._lock:
+            item = self._items.get((kind, key))
+            if item is None:
+                item = self._items[(kind, key)] = [factory(), 1]
+            return item[0]
+
+    def http_session(self, api_host):
+        """Return the HTTP session of an API host, never replaced under its other users."""
+        return self.shared('http', api_host, _new_http_session)
+
+    @staticmethod
+    def private_http_session():
+        """Return a new HTTP session of the pool's kind, for one client alone."""
+        return _new_http_session()
+
+    def breaker(self, name, **options):
+        """Return the circuit breaker of an endpoint, shared by all its clients."""
+        from .breaker import CircuitBreaker  # pylint: disable=import-outside-toplevel
+        return self.shared('breaker', name, lambda: CircuitBreaker(name, **options))
+
+    def limiter(self, account, **options):
+        """Return the request scheduler of an account, shared by all its clients."""
+        from .ratelimit import RateLimiter  # pylint: disable=import-outside-toplevel
+        return self.shared('ratelimit', account, lambda: RateLimiter(**options))
+
+    def acquire_mq(self, host, port, tls=False, worker=None, **options):
+        """Return the started MQTT connection to a broker, shared by all its users.
+
+        Users asking for other `options`, e.g. another keepalive, or another
+        `worker` get a connection of their own, with a distinct client id.
+        """
+        options = {k: v for k, v in options.items() if v is not None}
+        key = (host, port, bool(tls), worker or None, tuple(sorted(options.items())))
+
+        def factory():
+            from .fcmq import FcOpenMQ  # pylint: disable=import-outside-toplevel
+            name = f'{host}:{port}'
+            if worker:
+                name = f'{name}/{worker}'
+            if options:
+                # Connections side by side need distinct client ids.
+                name = f"{name}?{'&'.join(f'{k}={v}' for k, v in sorted(options.items()))}"
+            client_id = f"{CLIENT_ID_PREFIX}-{uuid.uuid5(uuid.NAMESPACE_DNS, name).hex[:8]}"
+            fc_mq = FcOpenMQ(
+                client_id, None, host=host, port=port, tls=tls, devices=[], **options,
+            )
+            fc_mq.pool_key = key
+            fc_mq.daemon = True
+            fc_mq.start()
+            return fc_mq
+
+        return self.acquire('mqtt', key, factory)
+
+    def release_mq(self, fc_mq, timeout=None):
+        """Release a connection from acquire_mq, stopping it when unused.
+
+        Returns True if it was stopped, raises TimeoutError if its threads
+        did not end within `timeout`.
+        """
+        def close(mq):
+            if not (mq.stop() if timeout is None else mq.stop(timeout)):
+                raise TimeoutError(f'mqtt thread {mq.name} still running')
+        return self.release('mqtt', fc_mq.pool_key, close)
+
+    def stats(self):
+        """Return the number of shared objects and references of each kind."""
+        with self._lock:
+            out = {}
+            for (kind, _), (_, refs) in self._items.items():
+                cur = out.setdefault(kind, {'objects': 0, 'refs': 0})
+                cur['objects'] += 1
+                cur['refs'] += refs
+            return out
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ResourcePool:
+    """Return the process wide pool."""
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            _pool = ResourcePool()
+        return _pool
@@ -0,0 +1,80 @@
+"""Sampling and deterministic profilers scoped to the integration's code."""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+
+INTEGRATION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SamplingProfiler(threading.Thread):
+    """Sample the stacks of all threads every `interval` seconds.
+
+    A sample is kept when it is taken in one of `thread_ids`, or when its stack
+    passes through a file under one of `paths`, so event loop and executor
+    work done on behalf of the integration is included too. Samples are
+    aggregated as collapsed stacks, as consumed by flamegraph tools.
+    """
+
+    def __init__(self, interval=0.005, thread_ids=None, paths=(INTEGRATION_DIR,), max_depth=64):
+        super().__init__(name='fcsmart-profiler', daemon=True)
+        self.interval = interval
+        self.thread_ids = set(thread_ids or ())
+        self.paths = tuple(paths)
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            self.samples += 1
+            for tid, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if tid == own:
+                    continue
+                stack = []
+                keep = tid in self.thread_ids
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    name = names.get(code)
+                    if name is None:
+                        name = names[code] = f'{os.path.basename(code.co_filename)}:{code.co_name}'
+                    if not keep and code.co_filename.startswith(self.paths):
+                        keep = True
+                    stack.append(name)
+                    frame = frame.f_back
+                if keep:
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        """Return the report as collapsed stacks, one `stack count` per line."""
+        return ''.join(f'{stack} {cnt}\n' for stack, cnt in self.stacks.most_common())
+
+
+class DeterministicProfiler:
+    """cProfile of the calling thread, normally the event loop."""
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def dump(self, path):
+        """Write binary pstats to `path` and return a text summary of the top entries."""
+        self._profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(30)
+        return out.getvalue()
@@ -0,0 +1,85 @@
+"""Signed HTTP push of lock messages, the webhook alternative to MQTT.
+
+A push body is one lock message, as published over MQTT plus the
+`deviceId` it is for, or a JSON list of them. It is signed with the
+shared secret of the receiving entry:
+
+    X-Fcsmart-Timestamp: <unix seconds>
+    X-Fcsmart-Signature: sha256=<hex HMAC-SHA256 of "<timestamp>." + body>
+
+Push a file of messages, e.g. from a relay or a test:
+
+    python -m core.push https://hass.local/api/webhook/<id> <secret> events.json
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import sys
+import time
+
+from .fcmq import check_message
+
+HEADER_SIGNATURE = 'X-Fcsmart-Signature'
+HEADER_TIMESTAMP = 'X-Fcsmart-Timestamp'
+# Bodies signed longer ago, or ahead, are refused as replays.
+MAX_SKEW = 300
+MAX_MESSAGES = 500
+
+
+def sign(secret, stamp, body: bytes) -> str:
+    mac = hmac.new(secret.encode(), f'{stamp}.'.encode() + body, hashlib.sha256)
+    return f'sha256={mac.hexdigest()}'
+
+
+def verify(secret, headers, body: bytes, now=None) -> bool:
+    """Return True if the body is signed with `secret` and recent."""
+    stamp = headers.get(HEADER_TIMESTAMP) or ''
+    if not stamp.isdigit() or abs((now or time.time()) - int(stamp)) > MAX_SKEW:
+        return False
+    return hmac.compare_digest(sign(secret, stamp, body), headers.get(HEADER_SIGNATURE) or '')
+
+
+def decode_body(body: bytes):
+    """Return the (device id, message) pairs of a push body, skipping those without data.
+
+    Raises ValueError when the body is not JSON or has too many messages.
+    """
+    rdt = json.loads(body.decode('utf8'))
+    rls = rdt if isinstance(rdt, list) else [rdt]
+    if len(rls) > MAX_MESSAGES:
+        raise ValueError(f'{len(rls)} messages, at most {MAX_MESSAGES} per push')
+    out = []
+    for msg in rls:
+        msg = check_message(msg)
+        if msg is None or not msg.get('deviceId'):
+            continue
+        out.append((str(msg['deviceId']), msg))
+    return out
+
+
+def headers_for(secret, body: bytes, stamp=None):
+    stamp = str(int(stamp or time.time()))
+    return {
+        'content-type': 'application/json',
+        HEADER_TIMESTAMP: stamp,
+        HEADER_SIGNATURE: sign(secret, stamp, body),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Push lock messages to a fcsmart webhook.')
+    parser.add_argument('url')
+    parser.add_argument('secret')
+    parser.add_argument('path', help='JSON file of one message or a list of them')
+    args = parser.parse_args(argv)
+    import requests  # pylint: disable=import-outside-toplevel
+    with open(args.path, 'rb') as fil:
+        body = fil.read()
+    rsp = requests.post(args.url, data=body, headers=headers_for(args.secret, body), timeout=10)
+    print(rsp.status_code, rsp.text)
+    return 0 if rsp.status_code == 200 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Token bucket with priority lanes for the cloud API of one account.
+
+Waiting calls are served strictly by lane, then in arrival order. The
+device list and background lanes may not take the last `reserve` tokens,
+so a command finds a token at once even while refreshes use up the rest
+of the budget. Background calls, e.g. the event backfill after a
+reconnect, go last and wait longest.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+INTERACTIVE = 0
+STATE = 1
+DEVICES = 2
+BACKGROUND = 3
+
+LANE_NAMES = ('interactive', 'state', 'devices', 'background')
+# Seconds a call of each lane waits for a token before giving up.
+LANE_TIMEOUTS = (10, 30, 60, 120)
+
+RATE = 5.0
+BURST = 10
+RESERVE = 2
+
+
+class RateLimitTimeout(ConnectionError):
+    """No token was free within the lane timeout, the call was not made."""
+
+
+class RateLimiter:
+    """Thread safe, blocking token bucket with priority lanes."""
+
+    def __init__(self, rate=RATE, burst=BURST, reserve=RESERVE):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = min(reserve, burst - 1)
+        self.tokens = float(burst)
+        self.granted = [0] * len(LANE_NAMES)
+        self.timeouts = [0] * len(LANE_NAMES)
+        self._stamp = time.monotonic()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _floor(self, lane):
+        return 1 + (self.reserve if lane >= DEVICES else 0)
+
+    def acquire(self, lane=STATE, timeout=None):
+        """Block until a token of `lane` is granted, return the seconds waited."""
+        timeout = LANE_TIMEOUTS[lane] if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        entry = (lane, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    floor = self._floor(lane)
+                    if self._waiters[0] == entry and self.tokens >= floor:
+                        heapq.heappop(self._waiters)
+                        self.tokens -= 1
+                        self.granted[lane] += 1
+                        # The next waiter may be served by what is left.
+                        self._cond.notify_all()
+                        return time.monotonic() - started
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        self.timeouts[lane] += 1
+                        raise RateLimitTimeout(f'no {LANE_NAMES[lane]} request budget within {timeout}s')
+                    wait = max(0.001, (floor - self.tokens) / self.rate)
+                    self._cond.wait(min(wait, left))
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                raise
+
+    def as_dict(self):
+        with self._cond:
+            self._refill()
+            return {
+                'tokens': round(self.tokens, 2),
+                'waiting': len(self._waiters),
+                'granted': dict(zip(LANE_NAMES, self.granted)),
+                'timeouts': dict(zip(LANE_NAMES, self.timeouts)),
+            }
@@ -0,0 +1,182 @@
+"""Record incoming MQTT messages to disk, and replay them.
+
+A recording is an append-only file of records, each a little endian
+`<d H I` header (receive time, topic length, payload length) followed by
+the topic and the raw payload. Files rotate to `.1`, `.2`... by size.
+
+Replay a recording through the decoder only:
+
+    python -m core.recorder recording.fcr --speed 10
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import logging
+
+from .fcmq import decode_message
+from .metrics import percentile
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'FCR1'
+HEADER = struct.Struct('<dHI')
+
+
+class MessageRecorder:
+    """Thread safe, size rotated append-only message recorder."""
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.path, 'ab', buffering=65536)  # pylint: disable=consider-using-with
+        self._size = self._file.tell()
+        if not self._size:
+            self._file.write(MAGIC)
+            self._size = len(MAGIC)
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            src = f'{self.path}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def record(self, topic, payload, stamp=None):
+        """Append one message."""
+        if isinstance(topic, str):
+            topic = topic.encode()
+        rec = HEADER.pack(stamp or time.time(), len(topic), len(payload)) + topic + payload
+        with self._lock:
+            if self._file is None:
+                self._open()
+            elif self._size + len(rec) > self.max_bytes:
+                self._rotate()
+            self._file.write(rec)
+            self._size += len(rec)
+            self.records += 1
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def recording_files(path):
+    """Return the files of a recording, oldest first."""
+    fls = [f'{path}.{i}' for i in range(99, 0, -1) if os.path.exists(f'{path}.{i}')]
+    if os.path.exists(path):
+        fls.append(path)
+    return fls
+
+
+def read_records(path):
+    """Yield (stamp, topic, payload) from one recording file."""
+    with open(path, 'rb') as fil:
+        if fil.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a fcsmart recording')
+        while True:
+            head = fil.read(HEADER.size)
+            if len(head) < HEADER.size:
+                return
+            stamp, tlen, plen = HEADER.unpack(head)
+            body = fil.read(tlen + plen)
+            if len(body) < tlen + plen:
+                # Truncated tail of a file still being written.
+                return
+            yield stamp, body[:tlen].decode(), body[tlen:]
+
+
+class ReplayEngine:
+    """Feed recorded messages through the decoder to a dispatcher.
+
+    `speed` is a multiple of real time, 0 replays as fast as possible.
+    `dispatch(topic, msg_dict)` receives each decoded message, e.g. a
+    function routing it to `Roller.on_message`.
+    """
+
+    def __init__(self, dispatch, speed=1.0):
+        self.dispatch = dispatch
+        self.speed = speed
+
+    def run(self, records):
+        """Replay an iterable of (stamp, topic, payload), return a report."""
+        lats = []
+        decode_failures = 0
+        skipped = 0
+        first = None
+        began = time.perf_counter()
+        for stamp, topic, payload in records:
+            if first is None:
+                first = stamp
+            due = began + (stamp - first) / self.speed if self.speed else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                msg_dict = decode_message(payload)
+            except (UnicodeDecodeError, ValueError):
+                decode_failures += 1
+                continue
+            if msg_dict is None:
+                skipped += 1
+                continue
+            self.dispatch(topic, msg_dict)
+            lats.append(time.perf_counter() - due)
+        elapsed = time.perf_counter() - began
+        lats.sort()
+        return {
+            'messages': len(lats),
+            'decode_failures': decode_failures,
+            'skipped': skipped,
+            'elapsed_s': round(elapsed, 3),
+            'throughput': round(len(lats) / elapsed, 1) if elapsed else 0,
+            'latency_ms': {
+                f'p{p}': round(percentile(lats, p) * 1000, 3) for p in (50, 90, 99)
+            },
+        }
+
+
+def replay_files(path, dispatch, speed=1.0):
+    """Replay all files of a recording, oldest first."""
+    def records():
+        for fil in recording_files(path):
+            yield from read_records(fil)
+    return ReplayEngine(dispatch, speed).run(records())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a fcsmart MQTT recording through the decoder.')
+    parser.add_argument('path')
+    parser.add_argument('--speed', type=float, default=0, help='multiple of real time, 0 for max speed')
+    args = parser.parse_args(argv)
+    report = replay_files(args.path, lambda topic, msg: None, args.speed)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""Soak run for resource growth against local broker and cloud stand-ins.
+
+Run from the integration directory:
+
+    python -m core.soak --cycles 50 --locks 50 --duration 60
+
+It repeats, against a `LocalBroker` and a `FakeCloudServer`:
+
+* reload cycles: entries log in, stream the device list, share a pooled
+  `FcOpenMQ`, receive messages and shut down as `hub.Hub` does;
+* reconnect storms: the broker drops every connection and messages must
+  flow again after each reconnect;
+* sustained load: messages at a steady rate while RSS is sampled.
+
+After each scenario the thread and file descriptor counts must be back
+near the baseline and RSS may only grow by a bounded amount. Run from the
+repository root with Home Assistant installed, it also sets up and shuts
+down real `hub.Hub` instances on a `HomeAssistant` core:
+
+    python -m custom_components.fcsmart.core.soak --hub-cycles 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+
+from .bench import rss_bytes
+from .fccloud import FcCloud
+from .fcmq import device_topic
+from .jsonstream import iter_items
+from .lifecycle import stop_all
+from .pool import get_pool
+from .standin import FakeCloudServer, LocalBroker, make_devices
+
+_LOGGER = logging.getLogger(__name__)
+
+THREAD_SLACK = 2
+FD_SLACK = 8
+RSS_GROWTH_MB = 32
+
+
+def fd_count():
+    """Return the open file descriptors of this process, None where unknown."""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def snapshot():
+    return {
+        'threads': threading.active_count(),
+        'fds': fd_count(),
+        'rss_mb': round(rss_bytes() / 1048576, 1),
+    }
+
+
+def settle(baseline, timeout=5.0):
+    """Wait for threads and descriptors to drop back to the baseline, return the last snapshot."""
+    deadline = time.monotonic() + timeout
+    while True:
+        snap = snapshot()
+        fds_ok = snap['fds'] is None or snap['fds'] <= baseline['fds'] + FD_SLACK
+        if (snap['threads'] <= baseline['threads'] + THREAD_SLACK and fds_ok) or time.monotonic() > deadline:
+            return snap
+        time.sleep(0.05)
+
+
+class Sink:
+    """Counts delivered messages."""
+
+    def __init__(self):
+        self.count = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, msg_dict):
+        with self._cond:
+            self.count += 1
+            self._cond.notify_all()
+
+    def wait(self, count, timeout=10):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count >= count, timeout)
+
+
+class Entry:
+    """The cloud and MQTT lifecycle of a config entry, without Home Assistant."""
+
+    def __init__(self, cloud, broker, username):
+        self.fcc = FcCloud(username, 'soak', api_host=cloud.url)
+        self.fcc._init_session()
+        self.fcc._login()
+        rsp = self.fcc.get_devices(page=1, page_size=len(cloud.devices) or 1, stream=True)
+        with rsp:
+            self.dvs = list(iter_items(rsp.iter_content(16384)))
+        self.sink = Sink()
+        self.mq = get_pool().acquire_mq(broker.host, broker.port)
+        for dev in self.dvs:
+            self.mq.add_device(dev['id'], self.sink)
+
+    def shutdown(self, deadline=10):
+        for dev in self.dvs:
+            self.mq.remove_device(dev['id'], self.sink)
+        return stop_all([('mqtt', partial(get_pool().release_mq, self.mq, deadline))], deadline)
+
+
+def publish_all(broker, dvs, seq=0):
+    for i, dev in enumerate(dvs):
+        broker.publish(device_topic(dev['id']), json.dumps({
+            'id': seq + i, 't': int(time.time() * 1000),
+            'data': {'battery': 90, 'unlocking': False},
+        }))
+
+
+def reload_cycles(cloud, broker, cycles, entries=2):
+    """Set up and shut down `entries` entries `cycles` times, messages flowing each time."""
+    failures = []
+    for cycle in range(cycles):
+        ens = [Entry(cloud, broker, f'soak{i}') for i in range(entries)]
+        if not broker.wait_subscriptions(len(cloud.devices)):
+            failures.append(f'cycle {cycle}: subscriptions missing')
+        publish_all(broker, cloud.devices, cycle * len(cloud.devices))
+        for ent in ens:
+            if not ent.sink.wait(len(ent.dvs)):
+                failures.append(f'cycle {cycle}: {ent.sink.count} of {len(ent.dvs)} messages')
+        for ent in ens:
+            failed = ent.shutdown()
+            if failed:
+                failures.append(f'cycle {cycle}: {failed}')
+    return failures
+
+
+def reconnect_storm(cloud, broker, storms):
+    """Drop all broker connections `storms` times, messages must flow after each."""
+    failures = []
+    ent = Entry(cloud, broker, 'storm')
+    try:
+        broker.wait_subscriptions(len(ent.dvs))
+        for storm in range(storms):
+            before = ent.mq.metrics.counter('mqtt.connects')
+            broker.disconnect_all()
+            deadline = time.monotonic() + 15
+            while ent.mq.metrics.counter('mqtt.connects') <= before and time.monotonic() < deadline:
+                time.sleep(0.02)
+            if not broker.wait_subscriptions(len(ent.dvs), 5):
+                failures.append(f'storm {storm}: not resubscribed')
+            want = ent.sink.count + len(ent.dvs)
+            publish_all(broker, ent.dvs, storm * len(ent.dvs))
+            if not ent.sink.wait(want):
+                failures.append(f'storm {storm}: {want - ent.sink.count} messages lost')
+    finally:
+        failed = ent.shutdown()
+        if failed:
+            failures.append(str(failed))
+    return failures
+
+
+def sustained_load(cloud, broker, rate, duration):
+    """Publish at `rate` for `duration` seconds, return (failures, RSS samples in MB)."""
+    failures = []
+    samples = []
+    ent = Entry(cloud, broker, 'load')
+    try:
+        broker.wait_subscriptions(len(ent.dvs))
+        total = int(rate * duration)
+        began = time.perf_counter()
+        for seq in range(total):
+            delay = began + seq / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            dev = ent.dvs[seq % len(ent.dvs)]
+            publish_all(broker, [dev], seq)
+            if seq % max(1, int(rate)) == 0:
+                samples.append(round(rss_bytes() / 1048576, 1))
+        if not ent.sink.wait(total, 15):
+            failures.append(f'{total - ent.sink.count} of {total} messages lost')
+    finally:
+        failed = ent.shutdown()
+        if failed:
+            failures.append(str(failed))
+    return failures, samples
+
+
+async def _hub_cycles(cloud, broker, cycles, config_dir):
+    from homeassistant.core import HomeAssistant  # pylint: disable=import-outside-toplevel
+    from .. import hub as hub_module  # pylint: disable=import-outside-toplevel
+    from .endpoints import Endpoints  # pylint: disable=import-outside-toplevel
+    from .fingercrystal_cloud import FiotCloud  # pylint: disable=import-outside-toplevel
+
+    hass = HomeAssistant()
+    hass.config.config_dir = config_dir
+    failures = []
+    eps = Endpoints(cloud.url, broker.host, broker.port)
+    data = {'username': 'hub', 'password': 'soak', 'local_control': False}
+    try:
+        for cycle in range(cycles):
+            fcc = FiotCloud(hass, data['username'], data['password'], eps=eps)
+            await fcc.async_login()
+            hub = hub_module.Hub(hass, data, fcc, [])
+            await hub.async_refresh_devices()
+            await hass.async_block_till_done()
+            if len(hub.rollers) != len(cloud.devices):
+                failures.append(f'hub cycle {cycle}: {len(hub.rollers)} rollers')
+            await hass.async_add_executor_job(broker.wait_subscriptions, len(cloud.devices), 5)
+            failed = await hub.async_shutdown()
+            if failed:
+                failures.append(f'hub cycle {cycle}: {failed}')
+    finally:
+        await hass.async_stop(force=True)
+    return failures
+
+
+def hub_cycles(cloud, broker, cycles):
+    """Run Hub setup and shutdown cycles on a Home Assistant core, None if unavailable."""
+    try:
+        import homeassistant.core  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+        from .. import hub  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+    except ImportError as exc:
+        _LOGGER.warning('Skipping hub cycles: %s', exc)
+        return None
+    with tempfile.TemporaryDirectory() as config_dir:
+        return asyncio.run(_hub_cycles(cloud, broker, cycles, config_dir))
+
+
+def run(cycles=20, locks=20, storms=5, rate=200, duration=10, hub_cycles_=0, max_rss_growth_mb=RSS_GROWTH_MB):
+    """Run the soak scenarios and return a report with `ok` and `failures`."""
+    broker = LocalBroker().start()
+    cloud = FakeCloudServer(make_devices(locks)).start()
+    # Soak traffic is not what the per account budget is about.
+    for name in ('soak0', 'soak1', 'storm', 'load', 'hub'):
+        get_pool().limiter(f'{cloud.url}/{name}', rate=1000, burst=1000)
+    report = {'scenarios': {}, 'failures': []}
+    try:
+        # Warm up imports and the pooled HTTP session before the baseline.
+        Entry(cloud, broker, 'soak0').shutdown()
+        baseline = settle(snapshot(), 1)
+        report['baseline'] = baseline
+        scenarios = [
+            ('reload', partial(reload_cycles, cloud, broker, cycles)),
+            ('reconnect', partial(reconnect_storm, cloud, broker, storms)),
+            ('load', partial(sustained_load, cloud, broker, rate, duration)),
+        ]
+        if hub_cycles_:
+            scenarios.append(('hub', partial(hub_cycles, cloud, broker, hub_cycles_)))
+        for name, func in scenarios:
+            started = time.perf_counter()
+            out = func()
+            if out is None:
+                report['scenarios'][name] = {'skipped': True}
+                continue
+            failures, samples = out if isinstance(out, tuple) else (out, None)
+            after = settle(baseline)
+            res = {'elapsed_s': round(time.perf_counter() - started, 2), **after}
+            if samples:
+                res['rss_samples_mb'] = [samples[0], max(samples), samples[-1]]
+            if after['threads'] > baseline['threads'] + THREAD_SLACK:
+                failures.append(f"{after['threads'] - baseline['threads']} threads left")
+            if after['fds'] is not None and after['fds'] > baseline['fds'] + FD_SLACK:
+                failures.append(f"{after['fds'] - baseline['fds']} file descriptors left")
+            if after['rss_mb'] - baseline['rss_mb'] > max_rss_growth_mb:
+                failures.append(f"RSS grew {after['rss_mb'] - baseline['rss_mb']:.1f} MB")
+            res['failures'] = failures
+            report['scenarios'][name] = res
+            report['failures'].extend(f'{name}: {fail}' for fail in failures)
+    finally:
+        cloud.stop()
+        broker.stop()
+    report['ok'] = not report['failures']
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=20, help='reload cycles')
+    parser.add_argument('--locks', type=int, default=20, help='simulated locks')
+    parser.add_argument('--storms', type=int, default=5, help='broker disconnect storms')
+    parser.add_argument('--rate', type=float, default=200, help='messages per second of sustained load')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of sustained load')
+    parser.add_argument('--hub-cycles', type=int, default=0, help='Hub cycles, needs Home Assistant')
+    parser.add_argument('--max-rss-growth-mb', type=float, default=RSS_GROWTH_MB)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    report = run(
+        args.cycles, args.locks, args.storms, args.rate, args.duration,
+        args.hub_cycles, args.max_rss_growth_mb,
+    )
+    print(json.dumps(report, indent=2))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
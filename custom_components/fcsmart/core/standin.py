@@ -0,0 +1,456 @@
+"""Local stand-ins for the fingercrystal MQTT broker, cloud HTTP API and locks.
+
+Used by the benchmark harness, they speak just enough of MQTT 3.1.1 and 5, of
+the cloud API and of the LAN API for `FcOpenMQ`, `FcCloud` and
+`LocalTransport` to run unchanged against them.
+"""
+import json
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+RESPONSE_PREFIX = "&&&START&&&"
+
+
+def _encode_length(length):
+    out = bytearray()
+    while True:
+        byt = length % 128
+        length //= 128
+        if length:
+            byt |= 0x80
+        out.append(byt)
+        if not length:
+            return bytes(out)
+
+
+def _encode_str(value):
+    if isinstance(value, str):
+        value = value.encode()
+    return struct.pack('!H', len(value)) + value
+
+
+def _read_str(buf, pos):
+    length = struct.unpack_from('!H', buf, pos)[0]
+    pos += 2
+    return buf[pos:pos + length], pos + length
+
+
+def _read_length(buf, pos):
+    """Read a variable byte integer, return it and the position after it."""
+    value = 0
+    shift = 0
+    while True:
+        byt = buf[pos]
+        pos += 1
+        value |= (byt & 0x7F) << shift
+        shift += 7
+        if not byt & 0x80:
+            return value, pos
+
+
+def _skip_properties(session, buf, pos):
+    """Return the position after the properties of an MQTT 5 packet, none before 5."""
+    if session.version < 5:
+        return pos
+    length, pos = _read_length(buf, pos)
+    return pos + length
+
+
+def topic_matches(sub, topic):
+    """Return True if the topic filter `sub` matches `topic`."""
+    if sub == topic:
+        return True
+    sps = sub.split('/')
+    tps = topic.split('/')
+    for i, part in enumerate(sps):
+        if part == '#':
+            return True
+        if i >= len(tps) or (part != '+' and part != tps[i]):
+            return False
+    return len(sps) == len(tps)
+
+
+def split_shared(sub):
+    """Return the (group, filter) of a `$share/<group>/<filter>` subscription, group None if not shared."""
+    if sub.startswith('$share/'):
+        _, group, flt = sub.split('/', 2)
+        return group, flt
+    return None, sub
+
+
+class _Session:
+    """A connected broker client."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.client_id = ''
+        self.subscriptions = {}
+        self.version = 4
+        self.lock = threading.Lock()
+        self.mid = 0
+
+    def send(self, packet):
+        with self.lock:
+            self.sock.sendall(packet)
+
+    def next_mid(self):
+        self.mid = self.mid % 65535 + 1
+        return self.mid
+
+
+class LocalBroker:
+    """Minimal threaded MQTT 3.1.1 and 5 broker, QoS 0 and 1, no retained messages.
+
+    MQTT 5 properties are skipped and none are sent.
+
+    Persistent sessions keep their subscriptions, and queue QoS1 messages
+    while the client is away. A message matching a `$share/<group>/` shared
+    subscription goes to one connected member of the group, round robin.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(128)
+        self.host, self.port = self._sock.getsockname()
+        self._sessions = set()
+        self._persistent = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.published = 0
+        self._share_next = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept_loop, name='fcsmart-broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._sock.close()
+        for session in self.sessions():
+            self._close(session)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions)
+
+    def subscription_count(self):
+        return sum(len(s.subscriptions) for s in self.sessions())
+
+    def wait_subscriptions(self, count, timeout=10):
+        """Block until at least `count` topic filters are subscribed."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.subscription_count() >= count:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def disconnect_all(self):
+        """Drop every client connection, as a broker restart would."""
+        for session in self.sessions():
+            self._close(session)
+
+    def publish(self, topic, payload, qos=0):
+        """Publish a message to all matching subscribers."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.published += 1
+        online = set()
+        shared = {}
+        for session in self.sessions():
+            online.add(session.client_id)
+            for sub, sub_qos in list(session.subscriptions.items()):
+                group, flt = split_shared(sub)
+                if not topic_matches(flt, topic):
+                    continue
+                if group is not None:
+                    shared.setdefault((group, flt), []).append((session.client_id, session, sub_qos))
+                    continue
+                self._deliver(session, topic, payload, min(qos, sub_qos))
+                break
+        for key, members in shared.items():
+            members.sort(key=lambda member: member[0])
+            with self._lock:
+                turn = self._share_next.get(key, 0)
+                self._share_next[key] = turn + 1
+            _, session, sub_qos = members[turn % len(members)]
+            self._deliver(session, topic, payload, min(qos, sub_qos))
+        if not qos:
+            return
+        with self._lock:
+            offline = [(cid, st) for cid, st in self._persistent.items() if cid not in online]
+        for _, state in offline:
+            if any(q and topic_matches(sub, topic) for sub, q in state['subscriptions'].items()):
+                state['queue'].append((topic, payload))
+
+    def _deliver(self, session, topic, payload, qos):
+        body = _encode_str(topic)
+        if qos:
+            body += struct.pack('!H', session.next_mid())
+        if session.version >= 5:
+            body += b'\x00'
+        body += payload
+        try:
+            session.send(bytes([PUBLISH << 4 | qos << 1]) + _encode_length(len(body)) + body)
+        except OSError:
+            self._close(session)
+
+    def _accept_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(sock)
+            with self._lock:
+                self._sessions.add(session)
+            threading.Thread(target=self._client_loop, args=(session,), daemon=True).start()
+
+    def _close(self, session):
+        with self._lock:
+            self._sessions.discard(session)
+            if session.client_id in self._persistent:
+                self._persistent[session.client_id]['subscriptions'] = dict(session.subscriptions)
+        try:
+            session.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        session.sock.close()
+
+    def _recv(self, sock, size):
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = sock.recv(size - len(buf))
+            if not chunk:
+                raise ConnectionError('closed')
+            buf.extend(chunk)
+        return bytes(buf)
+
+    def _read_packet(self, sock):
+        header = self._recv(sock, 1)[0]
+        length = 0
+        multiplier = 1
+        while True:
+            byt = self._recv(sock, 1)[0]
+            length += (byt & 0x7F) * multiplier
+            multiplier *= 128
+            if not byt & 0x80:
+                break
+        return header, self._recv(sock, length) if length else b''
+
+    def _client_loop(self, session):
+        try:
+            while not self._stop_event.is_set():
+                header, body = self._read_packet(session.sock)
+                if not self._handle(session, header >> 4, header & 0x0F, body):
+                    break
+        except (OSError, ConnectionError, struct.error):
+            pass
+        self._close(session)
+
+    def _handle(self, session, ptype, flags, body):
+        if ptype == CONNECT:
+            _, pos = _read_str(body, 0)
+            session.version = body[pos]
+            clean = body[pos + 1] & 0x02
+            pos = _skip_properties(session, body, pos + 4)  # level, connect flags, keepalive
+            client_id, pos = _read_str(body, pos)
+            session.client_id = client_id.decode()
+            with self._lock:
+                state = self._persistent.pop(session.client_id, None)
+                if not clean:
+                    self._persistent[session.client_id] = {'subscriptions': {}, 'queue': []}
+            present = 1 if state is not None and not clean else 0
+            if session.version >= 5:
+                session.send(bytes([CONNACK << 4, 3, present, 0, 0]))
+            else:
+                session.send(bytes([CONNACK << 4, 2, present, 0]))
+            if present:
+                session.subscriptions.update(state['subscriptions'])
+                for topic, payload in state['queue']:
+                    self._deliver(session, topic, payload, 1)
+        elif ptype == SUBSCRIBE:
+            mid = body[:2]
+            pos = _skip_properties(session, body, 2)
+            granted = bytearray()
+            while pos < len(body):
+                topic, pos = _read_str(body, pos)
+                qos = min(body[pos] & 0x03, 1)
+                pos += 1
+                session.subscriptions[topic.decode()] = qos
+                granted.append(qos)
+            payload = mid + (b'\x00' if session.version >= 5 else b'') + bytes(granted)
+            session.send(bytes([SUBACK << 4]) + _encode_length(len(payload)) + payload)
+        elif ptype == UNSUBSCRIBE:
+            pos = _skip_properties(session, body, 2)
+            count = 0
+            while pos < len(body):
+                topic, pos = _read_str(body, pos)
+                session.subscriptions.pop(topic.decode(), None)
+                count += 1
+            payload = body[:2] + (b'\x00' + bytes(count) if session.version >= 5 else b'')
+            session.send(bytes([UNSUBACK << 4]) + _encode_length(len(payload)) + payload)
+        elif ptype == PUBLISH:
+            qos = (flags >> 1) & 3
+            topic, pos = _read_str(body, 0)
+            if qos:
+                session.send(bytes([PUBACK << 4, 2]) + body[pos:pos + 2])
+                pos += 2
+            pos = _skip_properties(session, body, pos)
+            self.publish(topic.decode(), body[pos:], qos)
+        elif ptype == PINGREQ:
+            session.send(bytes([PINGRESP << 4, 0]))
+        elif ptype == DISCONNECT:
+            return False
+        return True
+
+
+class FakeCloudServer:
+    """HTTP stand-in for the `loginPassword`, `getUserDevice` and `miotspec` endpoints."""
+
+    def __init__(self, devices=None, host='127.0.0.1', port=0, latency=0.0):
+        self.devices = devices or []
+        self.events = {}
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                size = int(self.headers.get('content-length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(size) or b'{}')
+                except ValueError:
+                    body = {}
+                status, data = server.handle(self.path, body)
+                out = (RESPONSE_PREFIX + json.dumps(data)).encode()
+                self.send_response(status)
+                self.send_header('content-type', 'application/json')
+                self.send_header('content-length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.host, self.port = self._httpd.server_address[:2]
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fcsmart-cloud', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def handle(self, path, body):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if path.endswith('/oauth2/loginPassword'):
+            return 200, {'data': {'id': 10001, 'token': f"token-{body.get('phone')}"}}
+        if path.endswith('/device/getUserDevice'):
+            if body.get('pageNo'):
+                size = int(body.get('pageSize') or 50)
+                start = (int(body['pageNo']) - 1) * size
+                return 200, {'data': self.devices[start:start + size], 'total': len(self.devices)}
+            return 200, {'data': self.devices}
+        if path.endswith('/device/getDeviceEvent'):
+            evs = [
+                e for e in self.events.get(str(body.get('deviceId')), [])
+                if e.get('t', 0) > int(body.get('startTime') or 0)
+            ]
+            return 200, {'data': evs[:int(body.get('pageSize') or 50)]}
+        if '/miotspec/' in path:
+            rls = [dict(p, code=0, value=0) for p in body.get('params') or []]
+            return 200, {'result': rls}
+        return 404, {'error': path}
+
+
+class FakeLocalDevice:
+    """HTTP stand-in for the LAN API of one lock, see `core.transport`."""
+
+    def __init__(self, device=None, host='127.0.0.1', port=0, latency=0.0):
+        self.state = {'battery': 100, 'unlocking': False}
+        self.state.update({k: v for k, v in (device or {}).items() if k in self.state})
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, status, data):
+                out = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('content-type', 'application/json')
+                self.send_header('content-length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def do_GET(self):
+                self._reply(*server.handle('GET', self.path, {}))
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.host, self.port = self._httpd.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name='fcsmart-lock', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def handle(self, method, path, body):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'GET' and path == '/state':
+            return 200, dict(self.state, t=int(time.time() * 1000))
+        return 404, {'error': path}
+
+
+def make_devices(count):
+    """Return `count` simulated lock records as returned by getUserDevice."""
+    return [
+        {'id': f'bench{i:05d}', 'name': f'Bench Lock {i}', 'battery': 100, 'unlocking': False}
+        for i in range(count)
+    ]
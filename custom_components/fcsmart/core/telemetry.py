@@ -0,0 +1,246 @@
+"""Fixed memory battery time series with downsampling and a depletion forecast.
+
+Each lock keeps its readings in typed array rings at three resolutions: the
+raw readings, hourly and daily averages. The drain rate is an exponentially
+weighted least squares fit over the hourly averages, updated as each hour
+closes, so the forecast never rescans the history.
+
+Readings are stamped on the clock of this host: those stamped by the
+server are moved onto it with the offset `ClockSkew` keeps, so a poll
+and a push of the same minute land in order in one bucket.
+"""
+import math
+import time
+from array import array
+from collections import deque
+
+# name, bucket seconds (0 keeps every reading), capacity
+TIERS = (
+    ('raw', 0, 256),
+    ('hour', 3600, 24 * 14),
+    ('day', 86400, 400),
+)
+
+# Readings older than this weigh half in the fit.
+HALF_LIFE_DAYS = 30
+# The fit needs this span of hourly points before it forecasts.
+MIN_SPAN_DAYS = 1
+# Level to forecast, and jump up that means the battery was replaced.
+REPLACE_LEVEL = 10
+REPLACED_JUMP = 20
+
+
+class Ring:
+    """Fixed size ring of (time, value) pairs held in typed arrays."""
+
+    def __init__(self, size):
+        self.size = size
+        self.times = array('d', bytes(8 * size))
+        self.values = array('f', bytes(4 * size))
+        self.head = 0
+        self.count = 0
+
+    def append(self, stamp, value):
+        self.times[self.head] = stamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def items(self):
+        """Return the (time, value) pairs, oldest first."""
+        start = (self.head - self.count) % self.size
+        idx = [(start + i) % self.size for i in range(self.count)]
+        return [(self.times[i], self.values[i]) for i in idx]
+
+    def last(self):
+        if not self.count:
+            return None
+        i = (self.head - 1) % self.size
+        return self.times[i], self.values[i]
+
+    def __len__(self):
+        return self.count
+
+
+class ClockSkew:
+    """Offset of the server clock from the clock of this host.
+
+    Taken from the receive times of live messages the server stamped: the
+    smallest `local - server` of the recent ones, the message that spent
+    the least time in transit, so a slow delivery does not skew it.
+    """
+
+    def __init__(self, size=32):
+        self._offsets = deque(maxlen=size)
+
+    def observe(self, server, local):
+        """Record a message stamped `server` and received at `local`, both in ms."""
+        self._offsets.append(local - server)
+
+    @property
+    def offset(self):
+        """Return the offset in ms to add to a server time, 0 before any message."""
+        return min(self._offsets) if self._offsets else 0
+
+    def to_local(self, server):
+        return server + self.offset
+
+
+class Tier:
+    """A ring of the averages of fixed time buckets."""
+
+    def __init__(self, name, bucket, size):
+        self.name = name
+        self.bucket = bucket
+        self.ring = Ring(size)
+        self._start = None
+        self._sum = 0.0
+        self._cnt = 0
+
+    def add(self, stamp, value):
+        """Add a reading, return the (time, average) of the bucket it closed, if any."""
+        if not self.bucket:
+            self.ring.append(stamp, value)
+            return stamp, value
+        start = stamp - stamp % self.bucket
+        closed = None
+        if self._start is not None and start != self._start:
+            closed = (self._start, self._sum / self._cnt)
+            self.ring.append(*closed)
+            self._sum, self._cnt = 0.0, 0
+        self._start = start
+        self._sum += value
+        self._cnt += 1
+        return closed
+
+    def pending(self):
+        """Return the open bucket as [start, sum, count], None when there is none."""
+        return [self._start, self._sum, self._cnt] if self._cnt else None
+
+    def restore(self, pending):
+        self._start, self._sum, self._cnt = float(pending[0]), float(pending[1]), int(pending[2])
+
+
+class DrainFit:
+    """Exponentially weighted linear fit of level against time in days."""
+
+    def __init__(self, half_life=HALF_LIFE_DAYS):
+        self.decay = math.log(2) / half_life
+        self.reset()
+
+    def reset(self):
+        self.origin = None
+        self.first = self.last = None
+        # Weighted sums of 1, x, x^2, y and x*y.
+        self.sums = [0.0] * 5
+
+    def add(self, stamp, value):
+        if self.origin is None:
+            self.origin = self.first = stamp
+        x = (stamp - self.origin) / 86400
+        if self.last is not None:
+            fade = math.exp(-self.decay * max(0.0, stamp - self.last) / 86400)
+            self.sums = [s * fade for s in self.sums]
+        self.last = stamp
+        sw, sx, sxx, sy, sxy = self.sums
+        self.sums = [sw + 1, sx + x, sxx + x * x, sy + value, sxy + x * value]
+
+    def line(self):
+        """Return (slope per day, level now), or None without enough data."""
+        if self.first is None or (self.last - self.first) / 86400 < MIN_SPAN_DAYS:
+            return None
+        sw, sx, sxx, sy, sxy = self.sums
+        den = sw * sxx - sx * sx
+        if den <= 1e-9:
+            return None
+        slope = (sw * sxy - sx * sy) / den
+        intercept = (sy - slope * sx) / sw
+        return slope, intercept + slope * (self.last - self.origin) / 86400
+
+
+class BatterySeries:
+    """Battery readings of one lock."""
+
+    def __init__(self):
+        self.tiers = [Tier(*tier) for tier in TIERS]
+        self.fit = DrainFit()
+        self.replaced_at = None
+
+    def add(self, level, stamp=None):
+        """Add a reading in percent, at `stamp` seconds (now by default)."""
+        if level is None:
+            return
+        stamp = time.time() if stamp is None else stamp
+        level = float(level)
+        raw = self.tiers[0].ring.last()
+        if raw is not None:
+            if stamp < raw[0]:
+                # Late reading, e.g. from a backfill, the tiers only go forward.
+                return
+            if level - raw[1] >= REPLACED_JUMP:
+                self.fit.reset()
+                self.replaced_at = stamp
+        for tier in self.tiers:
+            closed = tier.add(stamp, level)
+            if tier.name == 'hour' and closed:
+                self.fit.add(*closed)
+
+    @property
+    def level(self):
+        last = self.tiers[0].ring.last()
+        return last[1] if last else None
+
+    def drain_per_day(self):
+        """Return the fitted drain in percent per day, positive when discharging."""
+        line = self.fit.line()
+        return -line[0] if line else None
+
+    def days_left(self, replace_level=REPLACE_LEVEL):
+        """Return the forecast days until the level reaches `replace_level`."""
+        line = self.fit.line()
+        if not line or line[0] >= -1e-6:
+            return None
+        # Start from the latest reading, the fit lags behind by up to an hour.
+        stamp, level = self.tiers[0].ring.last()
+        days = (level - replace_level) / -line[0] - (time.time() - stamp) / 86400
+        return max(0.0, days)
+
+    def series(self, name):
+        """Return the (time, value) pairs of a tier."""
+        for tier in self.tiers:
+            if tier.name == name:
+                return tier.ring.items()
+        raise KeyError(name)
+
+    def to_dict(self):
+        return {
+            'tiers': {t.name: [[s, round(v, 2)] for s, v in t.ring.items()] for t in self.tiers},
+            # The buckets still open, so a restart does not lose their readings.
+            'pending': {t.name: t.pending() for t in self.tiers if t.pending()},
+            'fit': {
+                'origin': self.fit.origin,
+                'first': self.fit.first,
+                'last': self.fit.last,
+                'sums': self.fit.sums,
+            },
+            'replaced_at': self.replaced_at,
+        }
+
+    @classmethod
+    def from_dict(cls, dat):
+        series = cls()
+        tiers = dat.get('tiers') or {}
+        pending = dat.get('pending') or {}
+        for tier in series.tiers:
+            for stamp, value in tiers.get(tier.name) or []:
+                tier.ring.append(stamp, value)
+            if len(pending.get(tier.name) or ()) == 3 and pending[tier.name][2]:
+                tier.restore(pending[tier.name])
+        fit = dat.get('fit') or {}
+        if fit.get('origin') is not None and len(fit.get('sums') or ()) == 5:
+            series.fit.origin = fit['origin']
+            series.fit.first = fit['first']
+            series.fit.last = fit['last']
+            series.fit.sums = [float(s) for s in fit['sums']]
+        series.replaced_at = dat.get('replaced_at')
+        return series
@@ -0,0 +1,230 @@
+"""State and command transports for a lock: LAN, cloud, and failover between them.
+
+Experimental: the LAN transport polls the state of the lock, or of its
+gateway, at the device record's `localip` over a small JSON over HTTP API,
+an assumed protocol that no lock is known to serve:
+
+    GET  /state                          -> {"battery": 80, "unlocking": false, "t": ms}
+
+It is off unless the `local_control` option is set. State returned by
+`get_state` has the same shape as the `data` of a pushed MQTT message, so
+it goes through `Roller` unchanged.
+
+No lock command is known, over the LAN or over the cloud API used by this
+integration, so no transport sends one: a guessed protocol could unlock
+the wrong way, or report an unlock that never happened.
+"""
+import abc
+import threading
+import time
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+LOCAL_PORT = 8086
+LOCAL_TIMEOUT = 2
+
+# Consecutive LAN failures before falling back to the cloud, and seconds
+# before the LAN is tried again.
+FAILURE_THRESHOLD = 3
+RETRY_AFTER = 60
+
+ACTIONS = ('lock', 'unlock')
+
+
+class TransportError(Exception):
+    """A transport failed to reach the device."""
+
+
+class TransportUnavailable(TransportError):
+    """The device, or the cloud in front of it, could not be reached at all.
+
+    Raised only when the request provably never left, so it is safe to
+    send again later. A request that went out and got no answer, e.g. a
+    read timeout, may have moved the lock and raises TransportError.
+    """
+
+
+def never_sent(exc) -> bool:
+    """Return True if a failed request provably did not reach the server."""
+    import requests  # pylint: disable=import-outside-toplevel
+    from urllib3.exceptions import NewConnectionError  # pylint: disable=import-outside-toplevel
+    from .breaker import CircuitOpenError  # pylint: disable=import-outside-toplevel
+    from .ratelimit import RateLimitTimeout  # pylint: disable=import-outside-toplevel
+    if isinstance(exc, (CircuitOpenError, RateLimitTimeout, requests.ConnectTimeout)):
+        return True
+    if isinstance(exc, requests.ConnectionError):
+        # Refused or unresolvable, as opposed to dropped after the request went out.
+        reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+class Transport(abc.ABC):
+    """Interface of a transport to one device."""
+
+    name = 'base'
+    # False when the transport cannot send commands at all.
+    commands = True
+
+    def get_state(self):
+        """Return the device state, or None when this transport has no state to poll."""
+        return None
+
+    @abc.abstractmethod
+    def send_command(self, action):
+        """Send `action` to the device, raise TransportError on failure."""
+
+    def close(self):
+        pass
+
+
+class CloudTransport(Transport):
+    """State pushed over MQTT, no commands."""
+
+    name = 'cloud'
+    commands = False
+
+    def __init__(self, fc_cloud, did):
+        self.fc_cloud = fc_cloud
+        self.did = did
+
+    def send_command(self, action):
+        raise TransportError(f'{action} of {self.did} is not supported over the cloud')
+
+
+class LocalTransport(Transport):
+    """State polled over the LAN, no commands."""
+
+    name = 'local'
+    commands = False
+
+    def __init__(self, host, port=None, timeout=LOCAL_TIMEOUT, metrics=None):
+        self.url = f'http://{host}:{port or LOCAL_PORT}'
+        self.timeout = timeout
+        self.metrics = metrics
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests  # pylint: disable=import-outside-toplevel
+            self._session = requests.Session()
+        return self._session
+
+    def _request(self, method, path, body=None):
+        try:
+            if self.metrics:
+                with self.metrics.timer(f'local.{path}'):
+                    rsp = self.session.request(method, self.url + '/' + path, json=body, timeout=self.timeout)
+            else:
+                rsp = self.session.request(method, self.url + '/' + path, json=body, timeout=self.timeout)
+        except OSError as exc:  # requests exceptions are OSErrors
+            if never_sent(exc):
+                raise TransportUnavailable(exc) from exc
+            raise TransportError(exc) from exc
+        if rsp.status_code != 200:
+            raise TransportError(f'{self.url}/{path}: {rsp.status_code}')
+        try:
+            return rsp.json()
+        except ValueError as exc:
+            raise TransportError(exc) from exc
+
+    def get_state(self):
+        return self._request('GET', 'state')
+
+    def send_command(self, action):
+        raise TransportError(f'{action} over the LAN is not supported, the lock protocol is unknown')
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class FailoverTransport(Transport):
+    """Use `primary` while healthy, `fallback` after repeated failures.
+
+    After `retry_after` seconds on the fallback the next call probes the
+    primary again, and switches back when it succeeds.
+    """
+
+    def __init__(self, primary, fallback, threshold=FAILURE_THRESHOLD, retry_after=RETRY_AFTER):
+        self.primary = primary
+        self.fallback = fallback
+        self.threshold = threshold
+        self.retry_after = retry_after
+        self.failures = 0
+        self.down_since = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.active.name
+
+    @property
+    def commands(self):
+        return self.primary.commands or self.fallback.commands
+
+    @property
+    def active(self):
+        """Return the transport calls currently go to."""
+        return self.fallback if self.down_since is not None else self.primary
+
+    def _primary_usable(self):
+        with self._lock:
+            if self.down_since is None:
+                return True
+            return time.monotonic() - self.down_since >= self.retry_after
+
+    def _record(self, ok, exc=None):
+        with self._lock:
+            if ok:
+                if self.down_since is not None:
+                    _LOGGER.info('%s transport is back, leaving %s', self.primary.name, self.fallback.name)
+                self.failures = 0
+                self.down_since = None
+                return
+            self.failures += 1
+            if self.down_since is not None:
+                # Failed probe, wait another period.
+                self.down_since = time.monotonic()
+            elif self.failures >= self.threshold:
+                _LOGGER.warning(
+                    '%s transport failed %s times (%s), using %s',
+                    self.primary.name, self.failures, exc, self.fallback.name,
+                )
+                self.down_since = time.monotonic()
+
+    def _call(self, method, *args):
+        if self._primary_usable():
+            try:
+                rdt = getattr(self.primary, method)(*args)
+            except TransportError as exc:
+                self._record(False, exc)
+            else:
+                self._record(True)
+                return rdt
+        return getattr(self.fallback, method)(*args)
+
+    def get_state(self):
+        return self._call('get_state')
+
+    def send_command(self, action):
+        if not self.fallback.commands:
+            # Nothing to fall back to, the primary is tried whatever its health.
+            return self.primary.send_command(action)
+        return self._call('send_command', action)
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+
+def device_transport(fc_cloud, dev, local=False, port=None, metrics=None):
+    """Return the transport of a device record, LAN first when `local` and it has a `localip`."""
+    cloud = CloudTransport(fc_cloud, dev['id'])
+    host = dev.get('localip')
+    if not local or not host:
+        return cloud
+    return FailoverTransport(LocalTransport(host, port, metrics=metrics), cloud)
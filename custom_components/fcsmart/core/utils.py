@@ -1,9 +1,3 @@
-import time
-import locale
-import requests
-from functools import partial
-
-
 class RC4:
     _idx = 0
     _jdx = 0
@@ -45,32 +39,3 @@ class RC4:
         self.crypt(bytes(1024))
         return self
 
-
-def analytics_track_event(event, action, label, value=0, **kwargs):
-    pag = f'https://miot-spec.com/s/{label}'
-    if kwargs:
-        pms = '&'.join([
-            f'{k}={v}'
-            for k, v in kwargs.items()
-            if v not in [None, '']
-        ])
-        pag = f"{pag}?{pms}"
-    pms = {
-        'id': '1280294351',
-        'lg': f'{locale.getdefaultlocale()[0]}'.lower().replace('-', '_'),
-        'ei': '|'.join([event, action, label, f'{value}', '']),
-        'p': pag,
-        't': 'Home Assistant',
-        'rnd': int(time.time() / 2.67),
-    }
-    url = 'https://ei.cnzz.com/stat.htm'
-    try:
-        return requests.get(url, params=pms, timeout=2)
-    except (Exception, ValueError):
-        return False
-
-
-async def async_analytics_track_event(hass, *args, **kwargs):
-    return await hass.async_add_executor_job(
-        partial(analytics_track_event, *args, **kwargs)
-    )
@@ -0,0 +1,108 @@
+"""Split the locks of an account over several worker processes.
+
+Each lock is owned by one worker, picked by rendezvous hashing of the
+worker names and the device id. Every worker computes the same owner from
+the same list of names, and adding or removing a worker only moves the
+locks it gains or had. A worker subscribes to the locks it owns, so the
+state of a lock is kept in one process.
+
+Several processes may instead consume one set of topics as an MQTT shared
+subscription group (`$share/<group>/<topic>`), where the broker hands each
+message to one member. Messages of one lock then spread over the members,
+which suits stateless consumers such as relays; members of a group need
+distinct client ids. A group cannot be combined with owners, the broker
+may hand a message to a member not owning the lock. Shared groups and
+MQTT 5 (`--protocol 5`) are only available from this CLI, the integration
+entries subscribe to the locks they own over MQTT 3.1.1.
+
+Run a standalone worker printing the messages of its locks as NDJSON:
+
+    python -m core.workers --mqtt host:1883 --me w1 --workers w1,w2,w3 lock1 lock2 ...
+"""
+import argparse
+import hashlib
+import json
+import signal
+import sys
+import threading
+
+from .fcmq import FcOpenMQ
+
+
+def parse(workers):
+    """Return the worker names of a comma separated string or a list, without blanks."""
+    if isinstance(workers, str):
+        workers = workers.split(',')
+    return [name.strip() for name in workers or () if name and name.strip()]
+
+
+def _score(worker, did):
+    digest = hashlib.blake2b(f'{worker}/{did}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def owners(did, workers, replicas=1):
+    """Return the `replicas` workers of a device, the owner first."""
+    return sorted(workers, key=lambda worker: _score(worker, did), reverse=True)[:replicas]
+
+
+def owner(did, workers):
+    """Return the worker owning a device, None without workers."""
+    if not workers:
+        return None
+    return max(workers, key=lambda worker: _score(worker, did))
+
+
+def owned(dids, me, workers):
+    """Return the devices of `dids` owned by worker `me`, all of them without workers."""
+    if not workers:
+        return list(dids)
+    return [did for did in dids if owner(str(did), workers) == me]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the lock messages of one worker as NDJSON.')
+    parser.add_argument('--mqtt', required=True, help='host[:port]')
+    parser.add_argument('--tls', action='store_true')
+    parser.add_argument('--protocol', type=int, choices=(4, 5), default=4, help='MQTT 3.1.1 or 5')
+    parser.add_argument('--group', help='shared subscription group')
+    parser.add_argument('--me', help='name of this worker, also its client id')
+    parser.add_argument('--workers', default='', help='comma separated names of all workers')
+    parser.add_argument('devices', nargs='+')
+    args = parser.parse_args(argv)
+
+    workers = parse(args.workers)
+    if workers and args.me not in workers:
+        parser.error(f'--me {args.me!r} is not one of --workers')
+    if workers and args.group:
+        parser.error('--group cannot be combined with --workers, pick one way to split the locks')
+    dids = owned(args.devices, args.me, workers)
+    host, _, port = args.mqtt.partition(':')
+    fc_mq = FcOpenMQ(
+        f'fcsmart-worker-{args.me or "solo"}', None, host=host, port=int(port) if port else None,
+        tls=args.tls, devices=dids, share_group=args.group, protocol=args.protocol,
+    )
+    lock = threading.Lock()
+
+    def printer(did):
+        def on_message(msg_dict):
+            with lock:
+                print(json.dumps({'device': did, **msg_dict}), flush=True)
+        return on_message
+
+    for did in dids:
+        fc_mq.add_device(did, printer(did))
+    print(json.dumps({'worker': args.me, 'devices': len(dids), 'of': len(args.devices)}), file=sys.stderr)
+    done = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: done.set())
+    fc_mq.start()
+    try:
+        done.wait()
+    except KeyboardInterrupt:
+        pass
+    fc_mq.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""Diagnostics support for fcsmart."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN, CONF_PASSWORD, CONF_WEBHOOK_ID, CONF_WEBHOOK_SECRET
+from .core.pool import get_pool
+
+TO_REDACT = {CONF_PASSWORD, CONF_WEBHOOK_ID, CONF_WEBHOOK_SECRET, 'service_token', 'ssecurity'}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    hub = hass.data[DOMAIN][entry.entry_id]
+    eps = hub.fc_cloud.endpoints
+    return {
+        'entry': async_redact_data(dict(entry.data), TO_REDACT),
+        'options': async_redact_data(dict(entry.options), TO_REDACT),
+        'endpoints': eps.to_dict() if eps else None,
+        'devices': len(hub.rollers),
+        'worker': {'name': hub.worker, 'workers': hub.workers},
+        'transports': {str(r.roller_id): r.transport.name for r in hub.rollers},
+        'updated': {
+            str(r.roller_id): {field: {'t': t, 'source': src} for field, (t, src) in r.updated.items()}
+            for r in hub.rollers
+        },
+        'battery': {
+            str(r.roller_id): {
+                'level': r.battery_series.level,
+                'drain_per_day': r.battery_series.drain_per_day(),
+                'days_left': r.battery_series.days_left(),
+                'daily': r.battery_series.series('day'),
+            }
+            for r in hub.rollers
+        },
+        'commands': hub.commands.pending() if hub.commands else None,
+        'metrics': hub.metrics.as_dict(),
+        'mqtt_metrics': hub.mq_metrics.as_dict(),
+        'breaker': hub.fc_cloud.breaker.as_dict(),
+        'ratelimit': hub.fc_cloud.limiter.as_dict(),
+        'pool': get_pool().stats(),
+        # The last report of the health sensor, diagnostics do not wait on a probe.
+        'health': hub.health,
+    }
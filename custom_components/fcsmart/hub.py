@@ -7,10 +7,19 @@ from __future__ import annotations
 # for more information.
 # This dummy hub always returns 3 rollers.
 import asyncio
+import json
 import random
 import logging
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from functools import partial
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
 
 from .core.fingercrystal_cloud import (
     FiotCloud,
@@ -18,7 +27,38 @@ from .core.fingercrystal_cloud import (
     FcCloudAccessDenied,
 )
 
-from .core.fcmq import FcOpenMQ
+from .core import health, lifecycle, workers
+from .core.cmdqueue import (
+    CommandQueue,
+    STATUS_EXPIRED,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    STATUS_SENT,
+    STATUS_SUPERSEDED,
+)
+from .core.metrics import Metrics
+from .core.pool import get_pool
+from .core.recorder import MessageRecorder
+from .core.telemetry import BatterySeries, ClockSkew
+from .core.transport import (
+    CloudTransport,
+    FailoverTransport,
+    TransportError,
+    TransportUnavailable,
+    device_transport,
+)
+from .const import (
+    DOMAIN,
+    CONF_LOCAL_CONTROL,
+    CONF_COMMAND_TTL,
+    CONF_MQTT_PORT,
+    CONF_MQTT_TLS,
+    CONF_MQTT_KEEPALIVE,
+    CONF_MQTT_RECORD,
+    CONF_MQTT_SHARE_GROUP,
+    CONF_WORKER_ID,
+    CONF_WORKERS,
+)
 
 from homeassistant.const import (
     STATE_JAMMED,
@@ -30,26 +70,368 @@ from homeassistant.const import (
 
 _LOGGER = logging.getLogger(__name__)
 
+LOCAL_POLL_INTERVAL = timedelta(seconds=10)
+TELEMETRY_SAVE_INTERVAL = timedelta(hours=1)
+COMMAND_REPLAY_INTERVAL = timedelta(seconds=30)
+SHUTDOWN_DEADLINE = 10
+
+# Sources of state updates, kept with the time of the update of each field.
+SOURCE_PUSH = 'push'
+SOURCE_BACKFILL = 'backfill'
+SOURCE_POLL = 'poll'
+SOURCE_LIST = 'list'
+SOURCE_COMMAND = 'command'
+# Sources timed by the device or the server, the others by the clock of this host.
+SERVER_SOURCES = (SOURCE_PUSH, SOURCE_BACKFILL)
+
+
+def event_time(msg_dict) -> int:
+    """Return the time (ms) of a message, 0 when it has none or a malformed one."""
+    try:
+        return int(msg_dict.get('t') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def entry_config(entry) -> dict:
+    """Return the settings of a config entry, its options over the data of its setup."""
+    return {**entry.data, **entry.options}
+
+
+def mqtt_port_for(data: dict, eps):
+    """Return the configured MQTT port, None for the default of the transport."""
+    # The resolved port is the plaintext one, TLS uses 8883 unless configured.
+    if data.get(CONF_MQTT_TLS):
+        return data.get(CONF_MQTT_PORT) or None
+    return eps.mqtt_port if eps else None
+
+
+def close_transports(rollers) -> None:
+    """Close the transports of rollers one after the other, in a single stop task."""
+    failed = []
+    for roller in rollers:
+        try:
+            roller.transport.close()
+        except Exception as exc:  # pylint: disable=broad-except
+            failed.append(f'{roller.roller_id}: {exc}')
+    if failed:
+        raise RuntimeError('; '.join(failed))
+
+
 class Hub:
     """Dummy hub for Hello World example."""
 
     manufacturer = "fingercrystal"
 
-    def __init__(self, hass: HomeAssistant, data: dict, fc_cloud: FiotCloud, dvs) -> None:
+    def __init__(self, hass: HomeAssistant, data: dict, fc_cloud: FiotCloud, dvs, cursors=None) -> None:
         """Init dummy hub."""
         self._hass = hass
         self._data = data
+        # The entry options it was set up with, see async_update_options.
+        self.options = {}
 
         self.fc_cloud = fc_cloud
+        self.metrics = fc_cloud.metrics
+        self.recorder = None
         self.rollers = []
+        self._cursors = cursors or {}
+        self._saved_series = {}
+        # Sent with the rollers added after setup, e.g. while the device list streams in.
+        self.signal_new_rollers = f"{DOMAIN}_new_rollers_{data.get('username')}"
+        # Locks owned by other workers are left to them, see core.workers.
+        self.worker = data.get(CONF_WORKER_ID) or None
+        self.workers = workers.parse(data.get(CONF_WORKERS))
+        if data.get(CONF_MQTT_SHARE_GROUP):
+            # The broker could hand a message to an instance not owning the lock, which drops it.
+            # Workers subscribe to the locks they own, shared groups are left to core.workers.
+            _LOGGER.warning(
+                'Ignoring MQTT share group %s of %s, only the core.workers CLI supports it',
+                data[CONF_MQTT_SHARE_GROUP], data.get('username'),
+            )
+        eps = fc_cloud.endpoints
+        tls = bool(data.get(CONF_MQTT_TLS))
+        mq_port = mqtt_port_for(data, eps)
+        # One connection per broker, shared with the other entries.
+        self.mq = get_pool().acquire_mq(
+            eps.mqtt_host if eps else None,
+            mq_port,
+            tls,
+            worker=self.worker,
+            keepalive=data.get(CONF_MQTT_KEEPALIVE),
+        )
+        if data.get(CONF_MQTT_RECORD):
+            if self.mq.recorder is None:
+                self.recorder = self.mq.recorder = MessageRecorder(hass.config.path(
+                    f'{DOMAIN}_recordings', f"{data.get('username')}.fcr",
+                ))
+            else:
+                # A connection has one recorder, it records the messages of every entry on it.
+                _LOGGER.warning(
+                    'MQTT of %s is already recorded to %s, shared with another entry',
+                    data.get('username'), self.mq.recorder.path,
+                )
+        self.mq.add_connect_listener(self._on_mq_connect)
+        self.metrics.gauge_fn('mqtt.queue_depth', self.mq.queue_depth)
+        self._unsub_poll = None
+        self._unsub_save = None
+        self._unsub_replay = None
+        # Commands that found their lock unreachable, see async_load_commands.
+        self.commands = None
+        self._replaying = False
+        self.health = None
+        self.online = True
+        self._released = False
+        self.add_devices(dvs)
+
+    @callback
+    def add_devices(self, dvs) -> list:
+        """Create the rollers of devices not known yet, return them.
+
+        Platforms already set up are told with `signal_new_rollers`.
+        """
+        if self._released:
+            # A late page of a download started before unload.
+            return []
+        known = {str(roller.roller_id) for roller in self.rollers}
+        now = int(time.time() * 1000)
+        news = []
         for dev in dvs:
+            did = str(dev['id'])
+            if did in known or not self.owns(did):
+                continue
+            known.add(did)
             roller = Roller(dev['id'], dev['name'], self)
-            self.rollers.append(roller)
-            fc_mq = FcOpenMQ(dev['id'], data.get('username'), data.get('password'))
-            fc_mq.start()
-            roller.mq = fc_mq
-            fc_mq.add_message_listener(roller.on_message)
-        self.online = True
+            # Without a stored cursor start from now, so we never download the full log.
+            roller.event_cursor = int(self._cursors.get(did) or now)
+            if did in self._saved_series:
+                roller.battery_series = BatterySeries.from_dict(self._saved_series.pop(did))
+            roller.transport = device_transport(
+                self.fc_cloud, dev, self._data.get(CONF_LOCAL_CONTROL, False), metrics=self.metrics,
+            )
+            roller.mq = self.mq
+            self.mq.add_device(dev['id'], roller.on_message)
+            news.append(roller)
+        if not news:
+            return news
+        self.rollers.extend(news)
+        if self.mq.client is not None and self.mq.client.is_connected():
+            # No connect callback will come for an already connected broker.
+            self._hass.async_create_task(self.async_backfill_all([(r, r.event_cursor) for r in news]))
+        if self._unsub_poll is None and any(isinstance(r.transport, FailoverTransport) for r in news):
+            # LAN state keeps coming when the cloud, and so the mqtt push, is away.
+            self._unsub_poll = async_track_time_interval(self._hass, self.async_poll_local, LOCAL_POLL_INTERVAL)
+        async_dispatcher_send(self._hass, self.signal_new_rollers, news)
+        return news
+
+    def owns(self, did) -> bool:
+        """Return True if this worker keeps the state of a lock, always without workers."""
+        if not self.workers or self.worker is None:
+            return True
+        return workers.owner(str(did), self.workers) == self.worker
+
+    async def async_refresh_devices(self) -> None:
+        """Download the device list, adding rollers page by page as it arrives."""
+        await self.fc_cloud.async_get_devices(renew=True, on_batch=self.add_devices)
+
+    @property
+    def mq_metrics(self):
+        """Return the metrics of the mqtt connection, shared by its entries."""
+        return self.mq.metrics
+
+    @property
+    def _telemetry_store(self) -> Store:
+        return Store(self._hass, 1, f'fingercrystal_fiot/battery-{self.fc_cloud.user_id}.json')
+
+    async def async_load_telemetry(self) -> None:
+        """Restore the battery series of the rollers, and save them periodically."""
+        dat = await self._telemetry_store.async_load() or {}
+        for roller in self.rollers:
+            if str(roller.roller_id) in dat:
+                roller.battery_series = BatterySeries.from_dict(dat.pop(str(roller.roller_id)))
+        # For the rollers still to come from the device list.
+        self._saved_series = dat
+        self._unsub_save = async_track_time_interval(
+            self._hass, self.async_save_telemetry, TELEMETRY_SAVE_INTERVAL,
+        )
+
+    async def async_save_telemetry(self, now=None) -> None:
+        await self._telemetry_store.async_save({
+            **self._saved_series,
+            **{str(roller.roller_id): roller.battery_series.to_dict() for roller in self.rollers},
+        })
+
+    async def async_load_commands(self) -> None:
+        """Open the queue of unsent commands, and retry them periodically.
+
+        The queue is opt in: with a `command_ttl` of 0, the default, commands
+        fail at once while their lock is unreachable. A queued unlock may
+        open the lock minutes after it was asked for.
+        """
+        ttl = self._data.get(CONF_COMMAND_TTL, 0)
+        if not ttl:
+            return
+        self.commands = await self._hass.async_add_executor_job(partial(
+            CommandQueue, self._hass.config.path(f'{DOMAIN}_commands', f"{self._data.get('username')}.jsonl"), ttl,
+        ))
+        self._unsub_replay = async_track_time_interval(
+            self._hass, self.async_replay_commands, COMMAND_REPLAY_INTERVAL,
+        )
+
+    async def async_replay_commands(self, now=None) -> None:
+        """Send the queued commands oldest first, until one finds its lock still unreachable."""
+        queue = self.commands
+        if not queue or self._replaying:
+            return
+        self._replaying = True
+        try:
+            for cmd in await self._hass.async_add_executor_job(queue.expire):
+                _LOGGER.warning('Dropped %s of %s queued since %s, expired', cmd['action'], cmd['did'], cmd['t'])
+                self.fire_command(cmd, STATUS_EXPIRED)
+            rollers = {str(roller.roller_id): roller for roller in self.rollers}
+            for cmd in queue.pending():
+                roller = rollers.get(cmd['did'])
+                if roller is None:
+                    # Its device is still to come from the list.
+                    continue
+                # A new command of the lock waits, it cannot be sent and then undone by this one.
+                async with roller.command_lock:
+                    if not queue.is_queued(cmd['key']):
+                        # Superseded meanwhile.
+                        continue
+                    sent = int(time.time() * 1000)
+                    try:
+                        await self._hass.async_add_executor_job(roller.transport.send_command, cmd['action'])
+                    except TransportUnavailable as exc:
+                        _LOGGER.debug('Replay of queued commands stopped: %s', exc)
+                        return
+                    except TransportError as exc:
+                        _LOGGER.warning('Queued %s of %s failed: %s', cmd['action'], cmd['did'], exc)
+                        status = STATUS_FAILED
+                    else:
+                        roller.command_sent(cmd['action'], sent)
+                        status = STATUS_SENT
+                    if await self._hass.async_add_executor_job(queue.done, cmd['key'], status):
+                        self.fire_command(cmd, status)
+        finally:
+            self._replaying = False
+
+    @callback
+    def fire_command(self, cmd, status) -> None:
+        """Tell automations what became of a queued command."""
+        self.metrics.inc(f'commands.{status}')
+        self._hass.bus.async_fire(f'{DOMAIN}_command', {
+            'device_id': cmd['did'],
+            'action': cmd['action'],
+            'key': cmd['key'],
+            'status': status,
+        })
+
+    async def async_shutdown(self, deadline=SHUTDOWN_DEADLINE) -> dict:
+        """Stop timers, callbacks and connections, see `shutdown`."""
+        self._released = True
+        for unsub in (self._unsub_poll, self._unsub_save, self._unsub_replay):
+            if unsub:
+                unsub()
+        self._unsub_poll = self._unsub_save = self._unsub_replay = None
+        for roller in self.rollers:
+            roller.clear_callbacks()
+        return await self._hass.async_add_executor_job(self.shutdown, deadline)
+
+    def shutdown(self, deadline=SHUTDOWN_DEADLINE) -> dict:
+        """Detach from the shared mqtt connection and close the rest in parallel.
+
+        The mqtt connection is stopped, and its threads joined, when this
+        was its last user. Returns `{resource: reason}` of what did not stop
+        within `deadline` seconds, also logged.
+        """
+        self.mq.remove_connect_listener(self._on_mq_connect)
+        for roller in self.rollers:
+            self.mq.remove_device(roller.roller_id, roller.on_message)
+        if self.recorder and self.mq.recorder is self.recorder:
+            self.mq.recorder = None
+        tasks = [('mqtt', partial(get_pool().release_mq, self.mq, deadline))]
+        if self.recorder:
+            tasks.append(('recorder', self.recorder.close))
+        if self.commands:
+            tasks.append(('commands', self.commands.close))
+        # Cloud transports hold nothing, the LAN ones close a session each.
+        lans = [r for r in self.rollers if r.transport is not None and not isinstance(r.transport, CloudTransport)]
+        if lans:
+            tasks.append(('transports', partial(close_transports, lans)))
+        failures = lifecycle.stop_all(tasks, deadline)
+        if failures:
+            _LOGGER.warning('Fingercrystal hub of %s did not stop cleanly: %s', self._data.get('username'), failures)
+        return failures
+
+    async def async_poll_local(self, now=None) -> None:
+        """Poll the state of the locks reachable over the LAN."""
+        rollers = [r for r in self.rollers if isinstance(r.transport, FailoverTransport)]
+        # A state without its own time is no newer than the request.
+        started = int(time.time() * 1000)
+        sts = await asyncio.gather(
+            *(self._hass.async_add_executor_job(r.transport.get_state) for r in rollers),
+            return_exceptions=True,
+        )
+        for roller, state in zip(rollers, sts):
+            if isinstance(state, dict):
+                roller.apply_state(state, SOURCE_POLL, started)
+            elif isinstance(state, Exception):
+                _LOGGER.debug('Poll state of %s failed: %s', roller.roller_id, state)
+
+    def dispatch_batch(self, msgs) -> None:
+        """Apply (device id, message) pairs, e.g. of one push body, as a batch per roller."""
+        by_did = {}
+        for did, msg in msgs:
+            by_did.setdefault(str(did), []).append(msg)
+        for roller in self.rollers:
+            evs = by_did.get(str(roller.roller_id))
+            if evs:
+                roller.apply_events(evs, SOURCE_PUSH)
+
+    def thread_ids(self) -> set:
+        """Return the ids of the mqtt thread and its paho network thread."""
+        tids = {self.mq.ident}
+        paho = getattr(self.mq.client, '_thread', None)
+        if paho is not None:
+            tids.add(paho.ident)
+        tids.discard(None)
+        return tids
+
+    def _on_mq_connect(self, reconnect: bool) -> None:
+        """Schedule an event backfill, called from the mqtt thread on (re)connect."""
+        # Runs before any message of the new connection, so the cursors still
+        # mark the last event received before the gap.
+        cursors = [(roller, roller.event_cursor) for roller in self.rollers]
+        self._hass.add_job(self.async_backfill_all, cursors)
+        if self.commands:
+            self._hass.add_job(self.async_replay_commands)
+
+    async def async_backfill_all(self, cursors, parallel=4) -> None:
+        """Backfill the rollers, a few at a time."""
+        sem = asyncio.Semaphore(parallel)
+
+        async def backfill(roller, since):
+            async with sem:
+                await self.async_backfill(roller, since, save=False)
+
+        await asyncio.gather(*(backfill(roller, since) for roller, since in cursors))
+        await self.fc_cloud.async_event_cursors(self.event_cursors())
+
+    async def async_backfill(self, roller, since: int, save=True) -> None:
+        """Fetch the events missed since `since` and feed them to the roller."""
+        evs = await self.fc_cloud.async_backfill_events(roller.roller_id, since)
+        for msg in roller.apply_events(evs):
+            self._hass.bus.async_fire(f'{DOMAIN}_event', {
+                'device_id': roller.roller_id,
+                't': msg.get('t'),
+                'data': msg.get('data'),
+            })
+        if save:
+            await self.fc_cloud.async_event_cursors(self.event_cursors())
+
+    def event_cursors(self) -> dict:
+        """Return the event cursors of all rollers, keyed by device id."""
+        return {str(roller.roller_id): roller.event_cursor for roller in self.rollers}
 
 
     @property
@@ -57,10 +439,38 @@ class Hub:
         """ID for dummy hub."""
         return self._id
 
-    async def test_connection(self) -> bool:
-        """Test connectivity to the Dummy hub is OK."""
-        await asyncio.sleep(1)
-        return True
+    async def test_connection(self) -> dict:
+        """Probe the cloud API, the device list and the MQTT broker concurrently.
+
+        Returns the report of `core.health.run`, also kept as `health`.
+        """
+        cfg = self.mq.mq_config
+        self.health = await self._hass.async_add_executor_job(partial(
+            health.run, self.fc_cloud.api_host, cfg.host, cfg.port, cfg.tls, self.fc_cloud,
+        ))
+        return self.health
+
+
+class ReplayHub:
+    """Rollers of their own, without entities, for replaying the devices of some hubs.
+
+    The live rollers would drop replayed history as duplicates or stale,
+    or move their locks back in time, so a replay feeds fresh rollers that
+    count into metrics of their own. Create it in the event loop.
+    """
+
+    def __init__(self, hubs) -> None:
+        self.metrics = Metrics()
+        self.rollers = {
+            str(roller.roller_id): Roller(roller.roller_id, roller.name, self)
+            for hub in hubs for roller in hub.rollers
+        }
+
+    def dispatch_message(self, topic: str, msg_dict: dict) -> None:
+        """Route a decoded message to its roller by topic, as the mqtt clients do."""
+        roller = self.rollers.get(topic.rsplit('/', 1)[-1])
+        if roller is not None:
+            roller.on_message(msg_dict)
 
 
 class Roller:
@@ -84,6 +494,22 @@ class Roller:
         self._battery = 0
         self._lock_state = STATE_LOCKED
         self._mq = None
+        self.transport = None
+        # Held while a command of the lock is sent, by calls and by the replay of queued ones.
+        self.command_lock = asyncio.Lock()
+        self.battery_series = BatterySeries()
+        self.clock_skew = ClockSkew()
+        # Time (ms) of the newest event received, and keys of recent events for dedup.
+        self.event_cursor = 0
+        self._recent_events = deque(maxlen=256)
+        self._recent_keys = set()
+        # Field -> (time in ms, source) of the update it was last set from.
+        self.updated = {}
+        # Field -> time (ms) of its last server timed update, and of its last
+        # update on the clock of this host. Pushes come from the mqtt thread.
+        self._server_t = {}
+        self._local_t = {}
+        self._lock = threading.Lock()
 
     @property
     def roller_id(self) -> str:
@@ -123,6 +549,10 @@ class Roller:
         """Remove previously registered callback."""
         self._callbacks.discard(callback)
 
+    def clear_callbacks(self) -> None:
+        """Remove all callbacks, e.g. of entities left behind by a failed platform unload."""
+        self._callbacks = set()
+
     # In a real implementation, this library would call it's call backs when it was
     # notified of any state changeds for the relevant device.
     async def publish_updates(self) -> None:
@@ -133,16 +563,162 @@ class Roller:
 
     def on_message(self, msg_dict):
         """Update state on message change."""
-        device = msg_dict['data']
-        self._battery = device['battery']
-        if device['unlocking']:
-            self.lock_state = STATE_UNLOCKING
-        else:
-            self.lock_state = STATE_LOCKED
+        if not self._track_event(msg_dict):
+            return
+        if not self._apply(msg_dict['data'], event_time(msg_dict), SOURCE_PUSH):
+            return
 
         for callback in self._callbacks:
             callback()
 
+    def apply_events(self, events, source=SOURCE_BACKFILL) -> list:
+        """Apply events in order, e.g. backfilled ones, skipping those already received.
+
+        Callbacks are called once for the whole batch. Returns the new events.
+        """
+        news = [msg for msg in events if msg.get('data') and self._track_event(msg)]
+        fresh = False
+        for msg in news:
+            fresh = self._apply(msg['data'], event_time(msg), source) or fresh
+        if fresh:
+            for callback in self._callbacks:
+                callback()
+        return news
+
+    def apply_state(self, state, source=SOURCE_POLL, t=None) -> None:
+        """Apply a polled state, calling the callbacks when it changed.
+
+        `t` (ms, on the clock of this host) is when the request started.
+        """
+        before = (self._battery, self._lock_state)
+        self._apply(state, t, source)
+        if (self._battery, self._lock_state) != before:
+            for callback in self._callbacks:
+                callback()
+
+    async def async_send_command(self, action: str, key=None) -> bool:
+        """Send `lock` or `unlock` over the best transport, raise TransportError on failure.
+
+        When the request provably never left, e.g. the connection was
+        refused, the command is queued instead, under the idempotency `key`
+        when given, and False is returned. A retry with a `key` already
+        handled gets the outcome of the first: True when it was sent, False
+        while it is queued, TransportError when it failed or was dropped.
+        """
+        async with self.command_lock:
+            return await self._async_send_command(action, key)
+
+    async def _async_send_command(self, action, key):
+        hass = self.hub._hass
+        queue = self.hub.commands
+        if queue is not None and key is not None and queue.seen(key):
+            status = queue.status(key)
+            if status == STATUS_SENT:
+                return True
+            if status == STATUS_QUEUED:
+                return False
+            raise TransportError(f'{action} of {self.roller_id} already handled, {status or "outcome unknown"}')
+        if queue is not None and queue.has(self.roller_id):
+            # Whatever happens to this one, the queued command is outdated.
+            old = await hass.async_add_executor_job(queue.supersede, self.roller_id)
+            if old:
+                self.hub.fire_command(old, STATUS_SUPERSEDED)
+        sent = int(time.time() * 1000)
+        try:
+            await hass.async_add_executor_job(self.transport.send_command, action)
+        except TransportUnavailable as exc:
+            if queue is None:
+                raise
+            cmd = await hass.async_add_executor_job(partial(queue.put, self.roller_id, action, key))
+            _LOGGER.warning('%s of %s queued, unreachable: %s', action, self.roller_id, exc)
+            if cmd:
+                self.hub.fire_command(cmd, STATUS_QUEUED)
+            return False
+        except TransportError:
+            if queue is not None and key is not None:
+                await hass.async_add_executor_job(queue.record, key, STATUS_FAILED)
+            raise
+        _LOGGER.debug('%s %s sent over %s', self.roller_id, action, self.transport.name)
+        if queue is not None and key is not None:
+            await hass.async_add_executor_job(queue.record, key, STATUS_SENT)
+        self.command_sent(action, sent)
+        return True
+
+    def command_sent(self, action: str, sent: int) -> None:
+        """Set the state a command sent at `sent` (ms) leads to."""
+        # Optimistic until the device reports its state, unless it already has.
+        with self._lock:
+            fresh = self._fresh('lock', sent, SOURCE_COMMAND, sent)
+            if fresh:
+                self.lock_state = STATE_UNLOCKING if action == 'unlock' else STATE_LOCKED
+        if fresh:
+            for callback in self._callbacks:
+                callback()
+
+    def _apply(self, device, t=None, source=SOURCE_PUSH) -> bool:
+        """Apply the fields of a state reported at `t` (ms), return True if any was newer.
+
+        Each field keeps the last writer by time, so a poll answered late
+        does not undo a push that came in meanwhile.
+        """
+        now = int(time.time() * 1000)
+        t = int(t) if t else now
+        fresh = False
+        with self._lock:
+            if source == SOURCE_PUSH and t != now:
+                self.clock_skew.observe(t, now)
+            if device.get('battery') is not None and self._fresh('battery', t, source, now):
+                self._battery = device['battery']
+                # The series is on the clock of this host, whatever stamped the reading.
+                local = self.clock_skew.to_local(t) if source in SERVER_SOURCES else t
+                self.battery_series.add(self._battery, local / 1000)
+                fresh = True
+            if 'unlocking' in device and self._fresh('lock', t, source, now):
+                self.lock_state = STATE_UNLOCKING if device['unlocking'] else STATE_LOCKED
+                fresh = True
+        return fresh
+
+    def _fresh(self, field, t, source, now) -> bool:
+        """Stamp `field` with `t` and `source`, return False if it has a newer update.
+
+        The clocks of the server and of this host may be seconds apart, so
+        server timed updates are only ordered among themselves, and any of
+        them overrides a command. An update timed here, a poll or a command,
+        gives way to any update applied after it started. Called with the
+        lock held, `now` is the time on this host.
+        """
+        server = source in SERVER_SOURCES
+        last = (self._server_t if server else self._local_t).get(field)
+        if last is not None and t < last:
+            self.hub.metrics.inc(f'state.{source}.stale')
+            return False
+        if server:
+            self._server_t[field] = t
+            self._local_t[field] = max(now, self._local_t.get(field, 0))
+        else:
+            self._local_t[field] = t
+        self.updated[field] = (t, source)
+        return True
+
+    def _track_event(self, msg_dict) -> bool:
+        """Remember an event, return False if it was already seen, e.g. a QoS 1 redelivery."""
+        t = event_time(msg_dict)
+        key = msg_dict.get('id')
+        if not key and t:
+            # Distinct events may share a millisecond, redeliveries also share the data.
+            key = (t, json.dumps(msg_dict.get('data'), sort_keys=True, default=str))
+        with self._lock:
+            if key and key in self._recent_keys:
+                self.hub.metrics.inc('state.duplicates')
+                return False
+            if key:
+                if len(self._recent_events) == self._recent_events.maxlen:
+                    self._recent_keys.discard(self._recent_events[0])
+                self._recent_events.append(key)
+                self._recent_keys.add(key)
+            self.event_cursor = max(self.event_cursor, t)
+        return True
+
     @property
     def online(self) -> float:
         """Roller is online."""
@@ -15,22 +15,29 @@ from homeassistant.const import (
     STATE_UNLOCKING,
 )
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
 from .const import DOMAIN
+from .core.transport import TransportError
 
 
 # This function is called as part of the __init__.async_setup_entry (via the
 # hass.config_entries.async_forward_entry_setup call)
 async def async_setup_entry(hass, config_entry, async_add_entities):
     hub = hass.data[DOMAIN][config_entry.entry_id]
-    fc_cloud = hub.fc_cloud
-    new_devices = []
-    for roller in hub.rollers:
-        new_devices.append(MyLockEntity(roller))
-    if new_devices:
-        async_add_entities(new_devices)
+
+    @callback
+    def add_rollers(rollers):
+        new_devices = [MyLockEntity(roller) for roller in rollers]
+        if new_devices:
+            async_add_entities(new_devices)
+
+    add_rollers(hub.rollers)
+    # Rollers of devices still streaming in from the cloud.
+    config_entry.async_on_unload(async_dispatcher_connect(hass, hub.signal_new_rollers, add_rollers))
 
 
 # This entire class could be written to extend a base class to ensure common attributes
@@ -80,6 +87,9 @@ class MyLockEntity(LockEntity):
         self._roller.remove_callback(self.update)
 
     def update(self):
+        # Most messages only carry a new battery level.
+        if self._roller.lock_state == self._state:
+            return
         self._state = self._roller.lock_state
         self.async_write_ha_state()
 
@@ -141,6 +151,25 @@ class MyLockEntity(LockEntity):
         """Return true if lock is locked."""
         return self._state == STATE_LOCKED
 
+    async def async_lock(self, **kwargs: Any) -> None:
+        """Lock the device."""
+        await self._async_send('lock')
+
+    async def async_unlock(self, **kwargs: Any) -> None:
+        """Unlock the device."""
+        await self._async_send('unlock')
+
+    async def _async_send(self, action):
+        # Retries of one service call share its context, and so the idempotency key.
+        key = f'{self._context.id}-{self.entity_id}-{action}' if self._context else None
+        try:
+            sent = await self._roller.async_send_command(action, key)
+        except TransportError as exc:
+            raise HomeAssistantError(f'{action} {self._roller.name} failed: {exc}') from exc
+        if not sent:
+            # The lock did not move, the caller must not go on as if it had.
+            raise HomeAssistantError(f'{action} {self._roller.name} queued, the lock is unreachable')
+
     @property
     def supported_features(self):
         """Flag supported features."""
@@ -0,0 +1,72 @@
+"""Webhook receiving lock messages pushed by the cloud or a local relay."""
+from __future__ import annotations
+
+import json
+import logging
+import secrets
+import time
+
+from aiohttp import web
+
+from homeassistant.components import webhook
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN, CONF_WEBHOOK_ID, CONF_WEBHOOK_SECRET
+from .core.fcmq import device_topic
+from .core.push import decode_body, verify
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_setup_push(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Register the webhook of an entry, creating its id and secret on first use."""
+    if not entry.data.get(CONF_WEBHOOK_ID):
+        hass.config_entries.async_update_entry(entry, data={
+            **entry.data,
+            CONF_WEBHOOK_ID: webhook.async_generate_id(),
+            CONF_WEBHOOK_SECRET: secrets.token_hex(16),
+        })
+        _LOGGER.info(
+            'Fingercrystal push webhook for %s: %s',
+            entry.data.get('username'), webhook.async_generate_path(entry.data[CONF_WEBHOOK_ID]),
+        )
+    webhook.async_register(
+        hass, DOMAIN, f"{DOMAIN} {entry.data.get('username')}", entry.data[CONF_WEBHOOK_ID], async_handle_push,
+    )
+
+
+def async_unload_push(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    webhook.async_unregister(hass, entry.data[CONF_WEBHOOK_ID])
+
+
+async def async_handle_push(hass: HomeAssistant, webhook_id: str, request: web.Request) -> web.Response:
+    """Verify a pushed body and feed its messages to the rollers, as mqtt does."""
+    entry = next((
+        ent for ent in hass.config_entries.async_entries(DOMAIN)
+        if ent.data.get(CONF_WEBHOOK_ID) == webhook_id
+    ), None)
+    hub = hass.data.get(DOMAIN, {}).get(entry.entry_id) if entry else None
+    if hub is None:
+        return web.Response(status=404)
+    body = await request.read()
+    if not verify(entry.data[CONF_WEBHOOK_SECRET], request.headers, body):
+        hub.metrics.inc('push.rejected')
+        _LOGGER.warning('Refused fingercrystal push with a bad or stale signature from %s', request.remote)
+        return web.Response(status=401)
+    try:
+        msgs = decode_body(body)
+    except (UnicodeDecodeError, ValueError) as exc:
+        hub.metrics.inc('push.decode_failures')
+        return web.Response(status=400, text=str(exc))
+    hub.metrics.inc('push.messages', len(msgs))
+    if hub.recorder and msgs:
+        # File writes and rotation stay off the event loop.
+        await hass.async_add_executor_job(_record, hub.recorder, msgs, time.time())
+    hub.dispatch_batch(msgs)
+    return web.json_response({'accepted': len(msgs)})
+
+
+def _record(recorder, msgs, stamp):
+    for did, msg in msgs:
+        recorder.record(device_topic(did), json.dumps(msg).encode(), stamp)
@@ -0,0 +1,12 @@
+"""Integration platform for recorder."""
+from __future__ import annotations
+
+from homeassistant.core import HomeAssistant, callback
+
+from .const import ATTR_DRAIN_PER_DAY, ATTR_REPLACE_LEVEL
+
+
+@callback
+def exclude_attributes(hass: HomeAssistant) -> set[str]:
+    """Exclude attributes that are static or derived from the recorded state."""
+    return {ATTR_DRAIN_PER_DAY, ATTR_REPLACE_LEVEL}
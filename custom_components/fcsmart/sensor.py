@@ -7,6 +7,7 @@
 # battery), the unit_of_measurement should match what's expected.
 import random
 import logging
+import time
 from datetime import datetime, timedelta
 
 from homeassistant.const import (
@@ -14,8 +15,13 @@ from homeassistant.const import (
     DEVICE_CLASS_BATTERY,
     DEVICE_CLASS_ILLUMINANCE,
     PERCENTAGE,
+    TIME_DAYS,
 )
-from homeassistant.helpers.entity import Entity
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity import Entity, EntityCategory
+from homeassistant.helpers.event import async_track_time_interval
 
 from homeassistant.helpers.update_coordinator import (
     CoordinatorEntity,
@@ -36,7 +42,9 @@ from .core.fingercrystal_cloud import (
     FcCloudAccessDenied,
 )
 
-from .const import DOMAIN
+from .const import DOMAIN, CONF_BATTERY_DEADBAND, ATTR_DRAIN_PER_DAY, ATTR_REPLACE_LEVEL
+from .core.telemetry import REPLACE_LEVEL
+from .hub import SOURCE_LIST, entry_config
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -49,17 +57,57 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     hub = hass.data[DOMAIN][config_entry.entry_id]
     fc_cloud = hub.fc_cloud
     new_devices = []
-    for roller in hub.rollers:
-        new_devices.append(BatterySensor(roller))
+    deadband = entry_config(config_entry).get(CONF_BATTERY_DEADBAND, 2)
+
+    def roller_sensors(rollers):
+        news = []
+        for roller in rollers:
+            news.append(BatterySensor(roller, deadband))
+            news.append(BatteryForecastSensor(roller))
+        return news
+
+    @callback
+    def add_rollers(rollers):
+        async_add_entities(roller_sensors(rollers))
+
+    new_devices.extend(roller_sensors(hub.rollers))
+    # Rollers of devices still streaming in from the cloud.
+    config_entry.async_on_unload(async_dispatcher_connect(hass, hub.signal_new_rollers, add_rollers))
+    if fc_cloud.user_id:
+        new_devices.extend(MetricSensor(hub, *desc) for desc in METRIC_SENSORS)
+        new_devices.append(HealthSensor(hub))
     if new_devices:
         # new_devices.append(MessageEntity(hass, hub))
         async_add_entities(new_devices)
 
+class DeadbandMixin:
+    """Report a numeric value only once it moved `_deadband` from the last reported one.
+
+    The band is centered on the reported value, so a reading flapping by a
+    point around it is never written to the recorder.
+    """
+
+    _deadband = 0
+    _reported = None
+
+    def _filter(self, value):
+        if (
+            value is None or self._reported is None or not self._deadband
+            or abs(value - self._reported) >= self._deadband
+        ):
+            self._reported = value
+        return self._reported
+
+
 # This base class shows the common properties and methods for a sensor as used in this
 # example. See each sensor for further details about properties and methods that
 # have been overridden.
-class SensorBase(Entity):
-    """Base representation of a Hello World Sensor."""
+class SensorBase(DeadbandMixin, SensorEntity):
+    """Base representation of a Hello World Sensor.
+
+    Subclasses return their raw value from `_read`, the state is written
+    only when it leaves the deadband.
+    """
 
     should_poll = False
 
@@ -67,6 +115,25 @@ class SensorBase(Entity):
         """Initialize the sensor."""
         self._roller = roller
 
+    def _read(self):
+        raise NotImplementedError
+
+    @property
+    def native_value(self):
+        return self._reported
+
+    async def async_added_to_hass(self):
+        self._filter(self._read())
+        self._roller.register_callback(self.update)
+
+    async def async_will_remove_from_hass(self):
+        self._roller.remove_callback(self.update)
+
+    def update(self):
+        before = self._reported
+        if self._filter(self._read()) != before:
+            self.async_write_ha_state()
+
     # To link this entity to the cover device, this property must return an
     # identifiers value matching that used in the cover, but no other information such
     # as name. If name is returned, this entity will then also become a device in the
@@ -102,11 +169,14 @@ class BatterySensor(SensorBase):
     # should be PERCENTAGE. A number of units are supported by HA, for some
     # examples, see:
     # https://developers.home-assistant.io/docs/core/entity/sensor#available-device-classes
-    _attr_unit_of_measurement = PERCENTAGE
+    _attr_native_unit_of_measurement = PERCENTAGE
+    # Long-term statistics keep hourly min/mean/max once raw history is purged.
+    _attr_state_class = SensorStateClass.MEASUREMENT
 
-    def __init__(self, roller):
+    def __init__(self, roller, deadband=2):
         """Initialize the sensor."""
         super().__init__(roller)
+        self._deadband = deadband
 
         # As per the sensor, this must be a unique value within this domain. This is done
         # by using the device ID, and appending "_battery"
@@ -115,24 +185,40 @@ class BatterySensor(SensorBase):
         # The name of the entity
         self._attr_name = f"{self._roller.name} Battery"
 
-        self._state = self._roller.battery_level
-
     # The value of this sensor. As this is a DEVICE_CLASS_BATTERY, this value must be
     # the battery level as a percentage (between 0 and 100)
-    @property
-    def state(self):
-        """Return the state of the sensor."""
-        return self._state
+    def _read(self):
+        return self._roller.battery_level
 
-    async def async_added_to_hass(self):
-        self._roller.register_callback(self.update)
 
-    def update(self):
-        self._state = self._roller.battery_level
-        self.async_write_ha_state()
+class BatteryForecastSensor(SensorBase):
+    """Days until the battery needs replacing, forecast from its drain rate."""
+
+    _attr_icon = 'mdi:battery-clock'
+    _attr_native_unit_of_measurement = TIME_DAYS
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    # The forecast moves a little on every reading.
+    _deadband = 1
+
+    def __init__(self, roller):
+        """Initialize the sensor."""
+        super().__init__(roller)
+        self._attr_unique_id = f"{self._roller.roller_id}_battery_forecast"
+        self._attr_name = f"{self._roller.name} Battery Replacement"
+
+    def _read(self):
+        """Return the forecast days, unknown until a day of readings is seen."""
+        days = self._roller.battery_series.days_left()
+        return None if days is None else round(days, 1)
+
+    @property
+    def extra_state_attributes(self):
+        drain = self._roller.battery_series.drain_per_day()
+        return {
+            ATTR_DRAIN_PER_DAY: None if drain is None else round(drain, 3),
+            ATTR_REPLACE_LEVEL: REPLACE_LEVEL,
+        }
 
-    async def async_will_remove_from_hass(self):
-        self._roller.remove_callback(self.update)
 
 class MessageEntity(CoordinatorEntity, Entity):
     """An entity using CoordinatorEntity.
@@ -189,17 +275,14 @@ class MessageEntity(CoordinatorEntity, Entity):
     async def fetch_latest_message(self):
         _LOGGER.info('fetch_latest_message')
 
+        # The list has no times, its states are no newer than the request.
+        started = int(time.time() * 1000)
         dvs = await self.fc_cloud.async_get_devices(renew=True)
 
         for device in dvs:
             for roller in self._rollers:
                 if roller.roller_id == device['id']:
-                    roller.battery_level = device['battery']
-                    if device['unlocking']:
-                        roller.lock_state = STATE_UNLOCKING
-                    else:
-                        roller.lock_state = STATE_LOCKED
-                    await roller.publish_updates()
+                    roller.apply_state(device, SOURCE_LIST, started)
 
         msg = {
             'msg_id': 'abc123456',
@@ -207,3 +290,123 @@ class MessageEntity(CoordinatorEntity, Entity):
         }
         return msg
 
+
+
+def _cloud_latency_p95(metrics):
+    """Return the worst p95 latency in ms over the cloud apis."""
+    p95s = [
+        hist.percentile(95) for name, hist in list(metrics.histograms.items())
+        if name.startswith('cloud.')
+    ]
+    return round(max(p95s) * 1000, 1) if p95s else None
+
+
+TOTAL_INCREASING = SensorStateClass.TOTAL_INCREASING
+MEASUREMENT = SensorStateClass.MEASUREMENT
+
+# key, name, unit, state class, deadband, value function of the hub. MQTT
+# metrics belong to the broker connection, which may be shared with other entries.
+METRIC_SENSORS = (
+    ('mqtt_messages', 'MQTT messages', None, TOTAL_INCREASING, 0,
+     lambda h: h.mq_metrics.counter('mqtt.messages')),
+    ('mqtt_decode_failures', 'MQTT decode failures', None, TOTAL_INCREASING, 0,
+     lambda h: h.mq_metrics.counter('mqtt.decode_failures')),
+    ('mqtt_reconnects', 'MQTT reconnects', None, TOTAL_INCREASING, 0,
+     lambda h: h.mq_metrics.counter('mqtt.reconnects')),
+    ('mqtt_queue_depth', 'MQTT queue depth', None, MEASUREMENT, 0,
+     lambda h: h.metrics.gauge('mqtt.queue_depth')),
+    ('cloud_requests', 'Cloud requests', None, TOTAL_INCREASING, 0,
+     lambda h: h.metrics.total('cloud.', '.requests')),
+    ('cloud_failures', 'Cloud failures', None, TOTAL_INCREASING, 0,
+     lambda h: h.metrics.total('cloud.', '.failures')),
+    ('cloud_latency', 'Cloud latency p95', 'ms', MEASUREMENT, 5,
+     lambda h: _cloud_latency_p95(h.metrics)),
+    ('cloud_circuit', 'Cloud circuit', None, None, 0,
+     lambda h: h.fc_cloud.breaker.state),
+)
+
+
+METRIC_INTERVAL = timedelta(seconds=30)
+
+
+class MetricSensor(DeadbandMixin, SensorEntity):
+    """Diagnostic sensor reporting one of the hub metrics.
+
+    The metric is read every `METRIC_INTERVAL`, the state is written only
+    when it leaves the deadband.
+    """
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    should_poll = False
+
+    def __init__(self, hub, key, name, unit, state_class, deadband, value_fn):
+        """Initialize the sensor."""
+        self._hub = hub
+        self._value_fn = value_fn
+        self._deadband = deadband
+        self._attr_unique_id = f'{DOMAIN}-{hub.fc_cloud.user_id}-metric-{key}'
+        self._attr_name = f'fingercrystal {hub.fc_cloud.user_id} {name}'
+        self._attr_native_unit_of_measurement = unit
+        self._attr_state_class = state_class
+
+    async def async_added_to_hass(self):
+        self._filter(self._value_fn(self._hub))
+        self.async_on_remove(async_track_time_interval(self.hass, self.async_refresh, METRIC_INTERVAL))
+
+    @callback
+    def async_refresh(self, now=None):
+        before = self._reported
+        if self._filter(self._value_fn(self._hub)) != before:
+            self.async_write_ha_state()
+
+    @property
+    def native_value(self):
+        return self._reported
+
+
+HEALTH_INTERVAL = timedelta(minutes=10)
+
+
+class HealthSensor(SensorEntity):
+    """Diagnostic sensor running the hub health probe periodically.
+
+    The state is `ok`, `degraded` when some checks fail, or `down` when all do.
+    """
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_icon = 'mdi:heart-pulse'
+    should_poll = False
+
+    def __init__(self, hub):
+        """Initialize the sensor."""
+        self._hub = hub
+        self._attr_unique_id = f'{DOMAIN}-{hub.fc_cloud.user_id}-health'
+        self._attr_name = f'fingercrystal {hub.fc_cloud.user_id} Connection health'
+
+    async def async_added_to_hass(self):
+        self.async_on_remove(async_track_time_interval(self.hass, self.async_probe, HEALTH_INTERVAL))
+        self.hass.async_create_task(self.async_probe())
+
+    async def async_probe(self, now=None):
+        await self._hub.test_connection()
+        self.async_write_ha_state()
+
+    @property
+    def native_value(self):
+        report = self._hub.health
+        if report is None:
+            return None
+        oks = [chk['ok'] for chk in report['checks'].values()]
+        if all(oks):
+            return 'ok'
+        return 'down' if not any(oks) else 'degraded'
+
+    @property
+    def extra_state_attributes(self):
+        report = self._hub.health or {'checks': {}}
+        attrs = {}
+        for name, chk in report['checks'].items():
+            for key, value in chk.items():
+                if key.endswith('_ms') or key == 'error':
+                    attrs[f'{name}_{key}'] = value
+        return attrs
@@ -0,0 +1,117 @@
+"""Services of the fcsmart integration."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+
+import voluptuous as vol
+
+from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.exceptions import HomeAssistantError
+
+from .const import DOMAIN
+from .hub import ReplayHub
+from .core.profiler import DeterministicProfiler, SamplingProfiler, INTEGRATION_DIR
+from .core.recorder import replay_files
+
+_LOGGER = logging.getLogger(__name__)
+
+SERVICE_PROFILE = 'profile'
+SERVICE_REPLAY = 'replay'
+
+PROFILE_SCHEMA = vol.Schema({
+    vol.Optional('seconds', default=60): vol.All(vol.Coerce(float), vol.Range(min=1, max=3600)),
+    vol.Optional('mode', default='sample'): vol.In(['sample', 'deterministic']),
+    vol.Optional('interval', default=0.005): vol.All(vol.Coerce(float), vol.Range(min=0.001, max=1)),
+})
+
+def _relative_path(value):
+    """Validate a path relative to the config dir, not leaving it."""
+    path = os.path.normpath(str(value))
+    if os.path.isabs(path) or path == '..' or path.startswith('..' + os.sep):
+        raise vol.Invalid('path must be relative to the config directory')
+    return path
+
+
+REPLAY_SCHEMA = vol.Schema({
+    vol.Required('path'): _relative_path,
+    vol.Optional('speed', default=1.0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+})
+
+
+def _write(path, text):
+    with open(path, 'w', encoding='utf-8') as fil:
+        fil.write(text)
+
+
+async def async_profile(hass: HomeAssistant, call: ServiceCall) -> None:
+    """Profile the integration for a while and write the report to the config dir."""
+    seconds = call.data['seconds']
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    if call.data['mode'] == 'deterministic':
+        # Only the event loop thread, where entity state writes happen.
+        prof = DeterministicProfiler()
+        prof.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.stop()
+        path = hass.config.path(f'{DOMAIN}_profile_{stamp}.pstats')
+        summary = await hass.async_add_executor_job(prof.dump, path)
+        _LOGGER.debug('Profile summary:\n%s', summary)
+    else:
+        tids = set()
+        for hub in hass.data.get(DOMAIN, {}).values():
+            tids |= hub.thread_ids()
+        prof = SamplingProfiler(call.data['interval'], tids, (INTEGRATION_DIR,))
+        prof.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await hass.async_add_executor_job(prof.stop)
+        path = hass.config.path(f'{DOMAIN}_profile_{stamp}.txt')
+        await hass.async_add_executor_job(_write, path, prof.collapsed())
+    _LOGGER.info('Wrote %s profile of %s seconds to %s', DOMAIN, seconds, path)
+
+
+async def async_replay(hass: HomeAssistant, call: ServiceCall) -> dict:
+    """Replay a recording, relative to the config dir, into rollers of the hubs' devices.
+
+    The rollers are replay copies, the live locks keep their state. The
+    replay runs in the executor, and the reported latency includes
+    `Roller.on_message`, as when the mqtt thread receives the messages.
+    """
+    root = os.path.realpath(hass.config.path())
+    path = os.path.realpath(hass.config.path(call.data['path']))
+    if os.path.commonpath([root, path]) != root:
+        raise HomeAssistantError(f'{call.data["path"]} is outside the config directory')
+    replay = ReplayHub(hass.data.get(DOMAIN, {}).values())
+    report = await hass.async_add_executor_job(replay_files, path, replay.dispatch_message, call.data['speed'])
+    report['state'] = replay.metrics.as_dict()['counters']
+    _LOGGER.info('Replayed %s: %s', path, report)
+    return report
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the integration services once."""
+    if hass.services.has_service(DOMAIN, SERVICE_PROFILE):
+        return
+
+    async def _profile(call: ServiceCall) -> None:
+        await async_profile(hass, call)
+
+    async def _replay(call: ServiceCall) -> None:
+        await async_replay(hass, call)
+
+    hass.services.async_register(DOMAIN, SERVICE_PROFILE, _profile, schema=PROFILE_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_REPLAY, _replay, schema=REPLAY_SCHEMA)
+
+
+def async_unload_services(hass: HomeAssistant) -> None:
+    """Remove the services when the last entry is unloaded."""
+    if hass.data.get(DOMAIN):
+        return
+    hass.services.async_remove(DOMAIN, SERVICE_PROFILE)
+    hass.services.async_remove(DOMAIN, SERVICE_REPLAY)
@@ -0,0 +1,12 @@
+"""Make `core` importable as when run from the integration directory.
+
+`core` needs no Home Assistant. Tests of the integration modules import
+`custom_components.fcsmart` from the repository root and are skipped
+without Home Assistant installed.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'custom_components', 'fcsmart'))
@@ -0,0 +1,110 @@
+"""Tests of core.cmdqueue.CommandQueue and its file across restarts."""
+import json
+
+import pytest
+
+from core import cmdqueue
+from core.cmdqueue import (
+    CommandQueue,
+    STATUS_EXPIRED,
+    STATUS_QUEUED,
+    STATUS_SENT,
+    STATUS_SUPERSEDED,
+)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'commands' / 'user.jsonl')
+
+
+def reopen(queue):
+    queue.close()
+    return CommandQueue(queue.path, queue.ttl)
+
+
+def lines(path):
+    with open(path, encoding='utf-8') as fil:
+        return [json.loads(line) for line in fil]
+
+
+def test_newer_command_supersedes(path):
+    queue = CommandQueue(path)
+    first = queue.put('lock1', 'unlock', key='k1', now=100)
+    second = queue.put('lock1', 'lock', key='k2', now=101)
+    queue.put('lock2', 'unlock', key='k3', now=102)
+    assert [cmd['key'] for cmd in queue.pending()] == ['k2', 'k3']
+    assert not queue.is_queued(first['key'])
+    assert queue.status('k1') == STATUS_SUPERSEDED
+    assert queue.status('k2') == STATUS_QUEUED
+    assert queue.supersede('lock1') == second
+    assert not queue.has('lock1')
+    assert queue.supersede('lock1') is None
+    queue = reopen(queue)
+    assert [cmd['key'] for cmd in queue.pending()] == ['k3']
+    assert queue.status('k2') == STATUS_SUPERSEDED
+
+
+def test_retried_key_is_not_queued_twice(path):
+    queue = CommandQueue(path)
+    assert queue.put('lock1', 'unlock', key='k1') is not None
+    assert queue.put('lock1', 'unlock', key='k1') is None
+    assert len(queue) == 1
+    queue.done('k1')
+    assert queue.put('lock1', 'unlock', key='k1') is None
+    assert queue.status('k1') == STATUS_SENT
+    assert queue.done('k1') is None
+    queue.record('k2', STATUS_SENT)
+    assert reopen(queue).status('k2') == STATUS_SENT
+
+
+def test_expired_commands_are_dropped(path):
+    queue = CommandQueue(path, ttl=60)
+    queue.put('lock1', 'unlock', key='k1', now=1000)
+    queue.put('lock2', 'unlock', key='k2', now=1000, ttl=600)
+    assert queue.expire(now=1059) == []
+    assert [cmd['key'] for cmd in queue.expire(now=1060)] == ['k1']
+    assert [cmd['key'] for cmd in queue.pending()] == ['k2']
+    assert queue.status('k1') == STATUS_EXPIRED
+    queue = reopen(queue)
+    assert [cmd['key'] for cmd in queue.pending()] == ['k2']
+    assert queue.status('k1') == STATUS_EXPIRED
+
+
+def test_torn_last_line_is_skipped(path):
+    queue = CommandQueue(path)
+    queue.put('lock1', 'unlock', key='k1', now=100)
+    queue.put('lock2', 'lock', key='k2', now=100)
+    queue.close()
+    with open(path, 'a', encoding='utf-8') as fil:
+        fil.write('{"op":"done","key":"k1","sta')
+    queue = CommandQueue(path)
+    assert [cmd['key'] for cmd in queue.pending()] == ['k1', 'k2']
+    # Loading rewrites the file without the torn line, the next change appends whole lines.
+    queue.done('k2')
+    queue = reopen(queue)
+    assert [cmd['key'] for cmd in queue.pending()] == ['k1']
+    assert queue.status('k2') == STATUS_SENT
+
+
+def test_file_is_compacted(path, monkeypatch):
+    monkeypatch.setattr(cmdqueue, 'RECENT_KEYS', 8)
+    queue = CommandQueue(path)
+    for i in range(200):
+        queue.put('lock1', 'unlock', key=f'k{i}', now=i)
+    records = lines(path)
+    assert len(records) < 200
+    assert len(records) <= cmdqueue.COMPACT_FACTOR * (1 + 8) + cmdqueue.COMPACT_SLACK + 1
+    queue = reopen(queue)
+    assert [cmd['key'] for cmd in queue.pending()] == ['k199']
+    assert queue.status('k198') == STATUS_SUPERSEDED
+    assert not queue.seen('k0')
+    assert len(lines(path)) == 1 + 8
+
+
+def test_full_queue_drops_the_oldest(path):
+    queue = CommandQueue(path, max_size=2)
+    for i in range(3):
+        queue.put(f'lock{i}', 'unlock', key=f'k{i}', now=i)
+    assert [cmd['key'] for cmd in queue.pending()] == ['k1', 'k2']
+    assert queue.status('k0') == cmdqueue.STATUS_DROPPED
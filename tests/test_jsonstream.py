@@ -0,0 +1,84 @@
+"""Tests of core.jsonstream.iter_items over arbitrary chunk boundaries."""
+import json
+
+import pytest
+
+from core.jsonstream import iter_items
+
+BODY = {
+    'code': 0,
+    'total': 3,
+    'data': [
+        {'id': 'a1', 'name': 'Front door', 'battery': 87, 'ratio': -1.5e-3},
+        {'id': 'b2', 'name': '後門 🔒', 'localip': None, 'ok': True},
+        {'id': 'c3', 'name': 'Gate', 'tags': ['x', {'y': [1, 2]}], 'ok': False},
+    ],
+    'msg': 'done',
+}
+
+
+def chunked(raw, size):
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+def parse(raw, size, key='data'):
+    fields = {}
+    items = list(iter_items(chunked(raw, size), key, fields))
+    return items, fields
+
+
+@pytest.mark.parametrize('prefix', ['', '&&&START&&&'])
+def test_every_split_point(prefix):
+    raw = (prefix + json.dumps(BODY, ensure_ascii=False)).encode()
+    for cut in range(1, len(raw)):
+        assert list(iter_items([raw[:cut], raw[cut:]])) == BODY['data'], cut
+    for size in (1, 2, 3, 7):
+        items, fields = parse(raw, size)
+        assert items == BODY['data']
+        assert fields == {'code': 0, 'total': 3, 'msg': 'done'}
+
+
+def test_unicode_split_inside_a_character():
+    raw = json.dumps({'data': [{'name': '後門 🔒'}]}, ensure_ascii=False).encode()
+    # Every byte alone, so the multi byte characters arrive in pieces.
+    assert list(iter_items(chunked(raw, 1))) == [{'name': '後門 🔒'}]
+
+
+@pytest.mark.parametrize('number', ['12345', '-0.25', '1.5e-3', '2E+10'])
+def test_number_split_across_chunks(number):
+    raw = ('{"total": %s, "data": [%s]}' % (number, number)).encode()
+    for cut in range(1, len(raw)):
+        fields = {}
+        assert list(iter_items([raw[:cut], raw[cut:]], 'data', fields)) == [json.loads(number)], cut
+        assert fields == {'total': json.loads(number)}, cut
+
+
+def test_empty_and_missing_array():
+    assert list(iter_items([b'{"data": []}'])) == []
+    assert list(iter_items([b'{}'])) == []
+    fields = {}
+    assert list(iter_items([b'{"code": 1}'], 'data', fields)) == []
+    assert fields == {'code': 1}
+
+
+def test_empty_chunks_are_skipped():
+    assert list(iter_items([b'', b'{"data"', b'', b': [1]}', b''])) == [1]
+
+
+@pytest.mark.parametrize('raw', [b'{"data": [1, 2', b'{"data": [{"id": 1}', b'[1, 2]', b''])
+def test_truncated_or_invalid_body_raises(raw):
+    with pytest.raises(ValueError):
+        list(iter_items(chunked(raw, 3)))
+
+
+def test_items_come_before_the_body_ends():
+    def chunks():
+        yield b'{"data": [{"id": 1}, '
+        # The first item must be out before the rest is read.
+        assert seen == [{'id': 1}]
+        yield b'{"id": 2}]}'
+
+    seen = []
+    for item in iter_items(chunks()):
+        seen.append(item)
+    assert seen == [{'id': 1}, {'id': 2}]
@@ -0,0 +1,97 @@
+"""Tests of the per field ordering of lock state updates in hub.Roller."""
+import time
+import types
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from custom_components.fcsmart import hub  # noqa: E402
+from custom_components.fcsmart.core.metrics import Metrics  # noqa: E402
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+@pytest.fixture
+def roller():
+    return hub.Roller('d1', 'Front door', types.SimpleNamespace(metrics=Metrics()))
+
+
+def push(roller, t, **data):
+    roller.on_message({'t': t, 'data': data})
+
+
+def test_older_push_is_stale_per_field(roller):
+    push(roller, 2000, battery=50)
+    push(roller, 1000, battery=40, unlocking=True)
+    # The battery had a newer push, the lock had none.
+    assert roller.battery_level == 50
+    assert roller.lock_state == hub.STATE_UNLOCKING
+    assert roller.updated['battery'] == (2000, hub.SOURCE_PUSH)
+    assert roller.updated['lock'] == (1000, hub.SOURCE_PUSH)
+    assert roller.hub.metrics.counter('state.push.stale') == 1
+
+
+def test_backfill_older_than_push_is_stale(roller):
+    push(roller, 5000, battery=60)
+    roller.apply_events([{'t': 4000, 'id': 'e1', 'data': {'battery': 70}}])
+    assert roller.battery_level == 60
+    roller.apply_events([{'t': 6000, 'id': 'e2', 'data': {'battery': 55}}])
+    assert roller.battery_level == 55
+    assert roller.updated['battery'] == (6000, hub.SOURCE_BACKFILL)
+
+
+def test_server_clock_behind_still_overrides_a_command(roller):
+    sent = now_ms()
+    roller.command_sent('unlock', sent)
+    assert roller.lock_state == hub.STATE_UNLOCKING
+    # The server clock is a minute behind this host.
+    push(roller, sent - 60000, unlocking=False)
+    assert roller.lock_state == hub.STATE_LOCKED
+
+
+def test_server_clock_ahead_does_not_block_polls(roller):
+    push(roller, now_ms() + 60000, battery=80)
+    time.sleep(0.002)
+    # A poll started after the push was applied is newer, whatever the server clock says.
+    roller.apply_state({'battery': 79}, hub.SOURCE_POLL, now_ms())
+    assert roller.battery_level == 79
+
+
+def test_poll_started_before_a_push_gives_way(roller):
+    started = now_ms() - 1000
+    push(roller, now_ms(), battery=30)
+    roller.apply_state({'battery': 90}, hub.SOURCE_POLL, started)
+    assert roller.battery_level == 30
+    assert roller.hub.metrics.counter('state.poll.stale') == 1
+
+
+def test_command_gives_way_to_a_later_poll_not_an_earlier_one(roller):
+    started = now_ms() - 1000
+    roller.command_sent('unlock', now_ms())
+    roller.apply_state({'unlocking': False}, hub.SOURCE_POLL, started)
+    assert roller.lock_state == hub.STATE_UNLOCKING
+    roller.apply_state({'unlocking': False}, hub.SOURCE_POLL, now_ms() + 1)
+    assert roller.lock_state == hub.STATE_LOCKED
+
+
+def test_fields_are_ordered_apart(roller):
+    push(roller, 3000, unlocking=True)
+    push(roller, 2000, battery=40)
+    assert roller.battery_level == 40
+    assert roller.lock_state == hub.STATE_UNLOCKING
+
+
+def test_redelivered_event_is_applied_once(roller):
+    calls = []
+    roller.register_callback(lambda: calls.append(1))
+    msg = {'t': 1000, 'data': {'battery': 10}}
+    roller.on_message(msg)
+    roller.on_message(dict(msg))
+    assert calls == [1]
+    assert roller.hub.metrics.counter('state.duplicates') == 1
+    # Another event of the same millisecond is not a redelivery.
+    roller.on_message({'t': 1000, 'data': {'battery': 11}})
+    assert roller.battery_level == 11